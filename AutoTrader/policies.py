@@ -1,6 +1,7 @@
 import datetime
 
 import query
+import stagnation
 import util
 from database import DatabaseConnection
 from settings import autotrade
@@ -22,6 +23,8 @@ NEVER_SELL = autotrade["never_sell"]
 USE_DYNAMIC_STAGNATION_DETECTION = autotrade["use_dynamic_stagnation_detection"]
 DYNAMIC_TOP_NR = autotrade["dynamic_top_nr"]
 DRY_RUN = autotrade["dry_run"]
+USE_GROWTH_SNAPSHOT = autotrade["use_growth_snapshot"]
+SNAPSHOT_MAX_AGE_HOURS = autotrade["snapshot_max_age_hours"]
 
 
 def __sell_and_spendings__(adapter, growths):
@@ -59,10 +62,14 @@ def __sell_and_spendings__(adapter, growths):
                 log.info("Not selling %s because its in the TOP %s." % (symbol, DYNAMIC_TOP_NR))
                 non_dust_coins.append(coin)
         else:
-            for symbol in list(sell):
+            sell_subs = {}
+            for symbol in sell:
                 subs = util.get_subs_for_symbol(adapter.coin_name_array, symbol)
                 assert len(subs) == 1
-                if not __stagnation_detection__(subs[0]):
+                sell_subs[symbol] = subs[0]
+            stagnating = __stagnation_detection__(list(sell_subs.values()))
+            for symbol in list(sell):
+                if sell_subs[symbol] not in stagnating:
                     sell.remove(symbol)
                     log.info("Not selling %s because its value is rising." % (symbol))
                     non_dust_coins.append(coin)
@@ -102,30 +109,12 @@ def __sell_and_spendings__(adapter, growths):
     return (sell, spend)
 
 
-def __stagnation_detection__(subreddit):
+def __stagnation_detection__(subreddit_list):
     """
-    Is the price for the coin belonging to subreddit stagnating?
+    Returns the subreddits whose coin prices are stagnating.
     """
-    start_time = datetime.datetime.utcnow() - datetime.timedelta(hours=STAGNATION_HOURS)
-    end_time = datetime.datetime.utcnow()
-    price_data = db.get_all_price_data_in_interval(start_time, end_time)
-    price_now = 0
-    price_xhrs_ago = 0
-    for line in price_data:
-        if line[0] == subreddit:
-            price_now = line[1]
-            break
-    for line in reversed(price_data):
-        if line[0] == subreddit:
-            price_xhrs_ago = line[1]
-            break
-    if price_now == 0 or price_xhrs_ago == 0:
-        log.warn("No price data for %s. Assuming no stagnation." % (subreddit))
-        return False
-    price_change = (price_now - price_xhrs_ago) / price_xhrs_ago
-    if price_change < STAGNATION_THRESHOLD:
-        return True
-    return False
+    return stagnation.stagnating(db, subreddit_list, datetime.datetime.utcnow(), STAGNATION_HOURS,
+                                 STAGNATION_THRESHOLD)
 
 
 def __dynamic_stagnation_detection__(db, coin_name_array, symbols):
@@ -133,49 +122,22 @@ def __dynamic_stagnation_detection__(db, coin_name_array, symbols):
     For a list of coins returns those that are among the last top DYNAMIC_TOP_NR
     gainers in the last STAGNATION_HOURS hours.
     """
-    now = datetime.datetime.utcnow()
-    start_time = now - datetime.timedelta(hours=STAGNATION_HOURS)
-    price_data = db.get_all_price_data_in_interval(start_time, now)
-    all_subs = []
-    price_changes = []
-    subreddit_list = []
-    # create list with all subs
-    for coin in coin_name_array:
-        all_subs.append(coin[-1])
-        if coin[-2] in symbols:
-            subreddit_list.append(coin[-1])
-
-    for subreddit in all_subs:
-        # get prices for each sub
-        price_now = 0
-        price_xhrs_ago = 0
-        for line in price_data:
-            if line[0] == subreddit:
-                price_now = line[1]
-                break
-        for line in reversed(price_data):
-            if line[0] == subreddit:
-                price_xhrs_ago = line[1]
-                break
-        # calculate price change
-        if price_now == 0 or price_xhrs_ago == 0:
-            log.warn("No price data for %s. Assuming no stagnation." % (subreddit))
-            price_change = float('inf')
-        else:
-            price_change = (price_now - price_xhrs_ago) / price_xhrs_ago
-        price_changes.append((subreddit, price_change))
-
-    price_changes = sorted(price_changes, key=lambda subr: subr[1])
-    price_changes.reverse()
-    top_gainers = [c[0] for c in price_changes[:DYNAMIC_TOP_NR]]
-    return [util.get_symbol_for_sub(coin_name_array, s) for s in subreddit_list if s in top_gainers]
+    all_subs = [coin[-1] for coin in coin_name_array]
+    subreddit_list = [coin[-1] for coin in coin_name_array if coin[-2] in symbols]
+    top_gainers = stagnation.top_gainers(db, subreddit_list, datetime.datetime.utcnow(), STAGNATION_HOURS,
+                                         DYNAMIC_TOP_NR, subreddits=all_subs)
+    return [util.get_symbol_for_sub(coin_name_array, s) for s in top_gainers]
 
 
 def subreddit_growth_policy(adapter):
     now = datetime.datetime.utcnow()
     start_time = now - datetime.timedelta(hours=GROWTH_HOURS)
     subs = [coin[-1] for coin in adapter.get_coins()]
-    growths = query.average_growth(db, subs, start_time, now, sort=True)
+    if USE_GROWTH_SNAPSHOT:
+        growths = query.snapshot_growth(db, subs, GROWTH_HOURS,
+                                        max_age=datetime.timedelta(hours=SNAPSHOT_MAX_AGE_HOURS))
+    else:
+        growths = query.average_growth(db, subs, start_time, now, sort=True)
     growths.reverse()
     log.info(growths)
     sell, spend = __sell_and_spendings__(adapter, growths)
@@ -0,0 +1,243 @@
+"""
+Benchmarks for the analysis code.
+All benchmarks except growth_db run on synthetic data, no database connection is needed.
+growth_db times the growth ranking queries against the configured database (skipped without one).
+
+Usage: python benchmark.py growth
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import datetime
+import time
+
+import numpy as np
+
+import correlation
+import query
+import regressor
+
+
+def first_last_rows(rows, key=0):
+    """
+    Groups rows by the column key in a single pass.
+    Returns a dict which maps each key to the first and the last row with this key.
+    """
+    result = {}
+    for row in rows:
+        k = row[key]
+        if k in result:
+            result[k][1] = row
+        else:
+            result[k] = [row, row]
+    return result
+
+
+class InMemoryRows(object):
+    """
+    Serves the interval queries used by query.average_growth from a list of rows.
+    The first/last rows are found in Python, so timings with it measure the ranking code only,
+    not the DISTINCT ON query and the indices (see bench_growth_db).
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def get_all_data_in_interval(self, start, end):
+        return self.rows
+
+    def get_first_last_data_in_interval(self, start, end, subreddits=None):
+        first_last = first_last_rows(self.rows)
+        return {sub: (first[1:5], last[1:5]) for sub, (first, last) in first_last.items()}
+
+
+def synthetic_data_rows(coins, hours, seed=0):
+    """
+    Creates hourly data rows (subreddit, 7 metrics) for coins subreddits (newest first).
+    """
+    rng = np.random.RandomState(seed)
+    subs = ["sub{}".format(i) for i in range(coins)]
+    metrics = rng.rand(hours, coins, 7) * 100
+    metrics[:, :, 0] = np.cumsum(rng.randint(0, 10, size=(hours, coins)), axis=0)
+    rows = []
+    for h in reversed(range(hours)):
+        for c, sub in enumerate(subs):
+            rows.append((sub,) + tuple(metrics[h, c]))
+    return subs, rows
+
+
+def best_time(f, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.time()
+        result = f()
+        best = min(best, time.time() - t)
+    return best, result
+
+
+def legacy_average_growth(db, subreddits, start_time, end_time):
+    """
+    The previous implementation of query.average_growth, which scans the interval for every subreddit.
+    """
+    data_points = db.get_all_data_in_interval(start_time, end_time)
+    result = []
+    for sub in subreddits:
+        found_row = False
+        for row in data_points:
+            if row[0] == sub:
+                metrics1 = row[1:5]
+                found_row = True
+                break
+        if not found_row:
+            continue
+        for row in reversed(data_points):
+            if row[0] == sub:
+                metrics2 = row[1:5]
+                break
+        result.append([sub, query.calc_mean_growth([metrics1, metrics2])])
+    return sorted(result, key=lambda subr: subr[1])
+
+
+def bench_growth(coins=250, days=30):
+    """
+    Growth ranking over a days long interval for coins subreddits.
+    Some subreddits without data are queried as well (like the markets do).
+    """
+    subs, rows = synthetic_data_rows(coins, days * 24)
+    db = InMemoryRows(rows)
+    queried = subs + ["missing{}".format(i) for i in range(coins // 10)]
+    end = datetime.datetime.utcnow()
+    start = end - datetime.timedelta(days=days)
+    query.log.disabled = True
+    t_old, old = best_time(lambda: legacy_average_growth(db, queried, start, end))
+    t_new, new = best_time(lambda: query.average_growth(db, queried, start, end))
+    query.log.disabled = False
+    assert old == new, "Rankings differ."
+    print("growth ranking (in memory, without the database query): {} coins, {} days, {} rows".format(
+        coins, days, len(rows)))
+    print("  per subreddit scan: {:8.3f}s".format(t_old))
+    print("  single pass:        {:8.3f}s".format(t_new))
+
+
+def bench_growth_db(days=30):
+    """
+    Growth ranking over the last days days on the configured database: fetching all rows of the interval
+    and scanning them per subreddit versus the DISTINCT ON query (query.average_growth).
+    """
+    try:
+        from database import DatabaseConnection
+        import util
+        db = DatabaseConnection(**util.get_postgres_auth())
+    except Exception as e:
+        print("growth ranking (database): skipped, no database ({})".format(e))
+        return
+    try:
+        subs = db.get_all_subreddits()
+        end = datetime.datetime.utcnow()
+        start = end - datetime.timedelta(days=days)
+        query.log.disabled = True
+        t_old, old = best_time(lambda: legacy_average_growth(db, subs, start, end))
+        t_new, new = best_time(lambda: query.average_growth(db, subs, start, end))
+        query.log.disabled = False
+        print("growth ranking (database): {} subreddits, {} days".format(len(subs), days))
+        print("  all rows + per subreddit scan: {:8.3f}s".format(t_old))
+        print("  first/last query:              {:8.3f}s".format(t_new))
+        if old != new:
+            print("  rankings differ (rows with equal timestamps are ordered differently)")
+    finally:
+        db.close()
+
+
+def bench_correlation(coins=250, days=30, lags=168):
+    """
+    Lagged correlations of all metrics with the forward price change on an hourly grid.
+    """
+    rng = np.random.RandomState(0)
+    hours = days * 24
+    x = rng.rand(hours, coins, 7)
+    y = rng.randn(hours, coins)
+    for method in ["direct", "fft"]:
+        t, corr = best_time(lambda: correlation.lagged_correlations(x, y, range(lags), method=method), repeat=1)
+        print("lagged correlation ({}): {} coins, {} days, {} lags -> {} in {:.3f}s".format(
+            method, coins, days, lags, corr.shape, t))
+    t, _ = best_time(lambda: correlation.rolling_correlation(x, y, 72, lag=12), repeat=1)
+    print("rolling correlation: 72h window in {:.3f}s".format(t))
+
+
+def legacy_quad_features(X):
+    """
+    The previous implementation of regressor.quad_features.
+    """
+    new_row_vecs = []
+    for row_vec in X:
+        new_row_vec = row_vec.copy()
+        for i, item1 in enumerate(row_vec):
+            for item2 in row_vec[i:]:
+                new_row_vec = np.append(new_row_vec, item1 * item2)
+        new_row_vecs.append(new_row_vec)
+    return np.asarray(new_row_vecs)
+
+
+def legacy_split_set(k, X, y):
+    """
+    The previous implementation of regressor.split_set (copies into lists and pops).
+    """
+    training_sets, training_values, test_sets, test_values = [], [], [], []
+    set_size = int(len(X) / k)
+    for i in range(k):
+        X_temp = list(X)
+        y_temp = list(y)
+        test_sets.append(X_temp[i * set_size:(i + 1) * set_size])
+        test_values.append(y_temp[i * set_size:(i + 1) * set_size])
+        for j in range(i * set_size, (i + 1) * set_size):
+            X_temp.pop(i * set_size)
+            y_temp.pop(i * set_size)
+        training_sets.append(X_temp)
+        training_values.append(y_temp)
+    return training_sets, training_values, test_sets, test_values
+
+
+def bench_regressor(rows=1000000, dims=6, legacy_rows=20000, k=5):
+    """
+    Polynomial feature expansion and k-fold splitting on a rows x dims matrix.
+    The previous implementations are timed on legacy_rows rows only.
+    """
+    rng = np.random.RandomState(0)
+    X = rng.rand(rows, dims)
+    y = rng.rand(rows)
+    small_X, small_y = X[:legacy_rows], y[:legacy_rows]
+    t_old, old = best_time(lambda: legacy_quad_features(small_X), repeat=1)
+    assert np.array_equal(old, regressor.quad_features(small_X)), "Features differ."
+    t_new, quad = best_time(lambda: regressor.quad_features(X))
+    print("quad features: {} rows x {} -> {} features".format(rows, dims, quad.shape[1]))
+    print("  per row append ({} rows): {:8.3f}s".format(legacy_rows, t_old))
+    print("  vectorized ({} rows):    {:8.3f}s".format(rows, t_new))
+    t_old, _ = best_time(lambda: legacy_split_set(k, small_X, small_y), repeat=1)
+    for scheme in ["contiguous", "shuffled", "time"]:
+        t_new, _ = best_time(lambda: regressor.kfold_indices(rows, k, scheme=scheme))
+        print("  {}-fold indices ({}, {} rows): {:8.3f}s".format(k, scheme, rows, t_new))
+    print("  split_set copies ({} rows):      {:8.3f}s".format(legacy_rows, t_old))
+
+
+BENCHMARKS = {
+    "growth": bench_growth,
+    "growth_db": bench_growth_db,
+    "correlation": bench_correlation,
+    "regressor": bench_regressor,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks")
+    parser.add_argument("names", nargs="*",
+                        help="Benchmarks to run (default: all): {}".format(", ".join(sorted(BENCHMARKS))))
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("Unknown benchmark: {}".format(name))
+    for name in args.names or sorted(BENCHMARKS.keys()):
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Rolling and lagged correlations between the social metrics and the forward price change.
+All functions work on the hourly grid of a panel.Panel and are vectorized over coins and metrics.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+import util
+from panel import DATA_METRICS
+
+log = util.setup_logger(__name__)
+
+
+def growth(values, horizon):
+    """
+    Relative change over the last horizon grid steps along the first axis (nan for the first steps).
+    """
+    result = np.full(values.shape, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result[horizon:] = (values[horizon:] - values[:-horizon]) / values[:-horizon]
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+
+def forward_growth(values, horizon):
+    """
+    Relative change over the next horizon grid steps along the first axis (nan for the last steps).
+    """
+    result = np.full(values.shape, np.nan)
+    result[:-horizon] = growth(values, horizon)[horizon:]
+    return result
+
+
+def signals(panel, horizon, metrics=None, transform="growth"):
+    """
+    Returns the metric signals (times x coins x metrics) and the forward price change (times x coins)
+    of a panel with data and price metrics.
+    transform: "growth" uses the change of each metric over the last horizon steps, "level" the metric itself.
+    """
+    if metrics is None:
+        metrics = DATA_METRICS
+    x = np.stack([panel.metric(m) for m in metrics], axis=2)
+    if transform == "growth":
+        x = growth(x, horizon)
+    elif transform != "level":
+        raise ValueError("Invalid transform: {}".format(transform))
+    y = forward_growth(panel.metric("price"), horizon)
+    return x, y
+
+
+def _direct(x, y, lags):
+    """
+    Exact pearson correlation of x[t - lag] and y[t] over the valid pairs of each lag.
+    x: times x coins x metrics, y: times x coins. Returns coins x lags x metrics.
+    """
+    t = x.shape[0]
+    result = np.full((x.shape[1], len(lags), x.shape[2]), np.nan)
+    for i, lag in enumerate(lags):
+        if lag >= t:
+            continue
+        a = x[:t - lag]
+        b = np.broadcast_to(y[lag:, :, None], a.shape)
+        valid = ~(np.isnan(a) | np.isnan(b))
+        n = valid.sum(axis=0)
+        a = np.where(valid, a, 0.)
+        b = np.where(valid, b, 0.)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ma = a.sum(axis=0) / n
+            mb = b.sum(axis=0) / n
+            cov = (a * b).sum(axis=0) / n - ma * mb
+            va = (a * a).sum(axis=0) / n - ma * ma
+            vb = (b * b).sum(axis=0) / n - mb * mb
+            result[:, i, :] = cov / np.sqrt(va * vb)
+    return result
+
+
+def _fft(x, y, lags):
+    """
+    Correlation of x[t - lag] and y[t] using the fft.
+    The series are standardized once over all times (instead of per lag), missing values are ignored.
+    x: times x coins x metrics, y: times x coins. Returns coins x lags x metrics.
+    """
+    t = x.shape[0]
+    y = np.broadcast_to(y[:, :, None], x.shape)
+    vx = ~np.isnan(x)
+    vy = ~np.isnan(y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        zx = np.where(vx, (x - np.nanmean(x, axis=0)) / np.nanstd(x, axis=0), 0.)
+        zy = np.where(vy, (y - np.nanmean(y, axis=0)) / np.nanstd(y, axis=0), 0.)
+    nfft = 1 << int(np.ceil(np.log2(2 * t)))
+
+    def xcorr(a, b):
+        # sum over t of a[t] * b[t + lag] for lag >= 0
+        return np.fft.irfft(np.conj(np.fft.rfft(a, nfft, axis=0)) * np.fft.rfft(b, nfft, axis=0), nfft, axis=0)
+
+    sums = xcorr(zx, zy)
+    counts = np.rint(xcorr(vx.astype(float), vy.astype(float)))
+    lags = np.asarray(lags)
+    inside = lags < t
+    result = np.full((len(lags),) + x.shape[1:], np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result[inside] = sums[lags[inside]] / counts[lags[inside]]
+    result[~np.isfinite(result)] = np.nan
+    return result.transpose(1, 0, 2)
+
+
+def lagged_correlations(x, y, lags, method="direct"):
+    """
+    Correlation of each metric signal lag steps before the forward price change,
+    i.e. corr(x[t - lag], y[t]) for every coin, lag and metric.
+    x: times x coins x metrics, y: times x coins. Returns an array of shape coins x lags x metrics.
+    method: "direct" (exact) or "fft" (approximate as the series are standardized once over all times,
+    faster for many lags).
+    """
+    lags = list(lags)
+    if method == "direct":
+        return _direct(x, y, lags)
+    elif method == "fft":
+        return _fft(x, y, lags)
+    raise ValueError("Invalid method: {}".format(method))
+
+
+def rolling_correlation(x, y, window, lag=0):
+    """
+    Correlation of x[t - lag] and y[t] over the last window steps for every time t.
+    x: times x coins x metrics, y: times x coins. Returns an array of shape times x coins x metrics
+    (nan until a full window is available).
+    """
+    t = x.shape[0]
+    result = np.full(x.shape, np.nan)
+    if lag + window > t:
+        return result
+    a = x[:t - lag]
+    b = np.broadcast_to(y[lag:, :, None], a.shape)
+    valid = ~(np.isnan(a) | np.isnan(b))
+    a = np.where(valid, a, 0.)
+    b = np.where(valid, b, 0.)
+
+    def window_sum(v):
+        c = np.cumsum(v, axis=0)
+        c = np.concatenate([np.zeros((1,) + v.shape[1:]), c], axis=0)
+        return c[window:] - c[:-window]
+
+    n = window_sum(valid.astype(float))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ma = window_sum(a) / n
+        mb = window_sum(b) / n
+        cov = window_sum(a * b) / n - ma * mb
+        va = window_sum(a * a) / n - ma * ma
+        vb = window_sum(b * b) / n - mb * mb
+        result[lag + window - 1:] = cov / np.sqrt(va * vb)
+    result[~np.isfinite(result)] = np.nan
+    return result
@@ -2,6 +2,7 @@ import datetime
 
 import numpy as np
 import psycopg2
+import psycopg2.extras
 
 from util import setup_logger
 
@@ -24,6 +25,9 @@ class DatabaseConnection(object):
             self.create_data_table()
         if (not self.price_table_exists()):
             self.create_price_table()
+        if (not self.growth_snapshot_table_exists()):
+            self.create_growth_snapshot_table()
+        self.create_indices()
 
     def close(self):
         """
@@ -33,6 +37,25 @@ class DatabaseConnection(object):
         self.cur.close()
         self.conn.close()
 
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        """
+        discard the uncommitted changes
+        """
+        self.conn.rollback()
+
+    def create_indices(self):
+        """
+        create the indices used by the interval and per subreddit queries (if they don't exist)
+        """
+        self.cur.execute("CREATE INDEX IF NOT EXISTS data_subreddit_time_idx ON data (subreddit, time);")
+        self.cur.execute("CREATE INDEX IF NOT EXISTS data_time_idx ON data (time);")
+        self.cur.execute("CREATE INDEX IF NOT EXISTS price_subreddit_time_idx ON price (subreddit, time);")
+        self.cur.execute("CREATE INDEX IF NOT EXISTS price_time_idx ON price (time);")
+        self.conn.commit()
+
     # ------------ price table ------------
 
     def price_table_exists(self):
@@ -107,6 +130,35 @@ class DatabaseConnection(object):
         self.cur.execute(querystr, (start, end))
         return self.cur.fetchall()
 
+    def get_price_series(self, subreddits, start, end):
+        """
+        Returns all (subreddit, time, price, percent_change_1h, percent_change_24h) rows in the given
+        interval ordered by subreddit and time. If subreddits is None the rows of all subreddits are returned.
+        """
+        if subreddits is None:
+            querystr = "SELECT subreddit, time, price, percent_change_1h, percent_change_24h FROM price \
+                    WHERE time > %s AND time < %s ORDER BY subreddit, time ASC"
+            self.cur.execute(querystr, (start, end))
+        else:
+            querystr = "SELECT subreddit, time, price, percent_change_1h, percent_change_24h FROM price \
+                    WHERE subreddit = ANY(%s) AND time > %s AND time < %s ORDER BY subreddit, time ASC"
+            self.cur.execute(querystr, (list(subreddits), start, end))
+        return self.cur.fetchall()
+
+    def get_first_last_price_in_interval(self, start, end):
+        """
+        Returns the newest and the oldest price for every subreddit in the given interval.
+        format: {subreddit: (newest price, oldest price)}
+        """
+        querystr = "SELECT n.subreddit, n.price, o.price FROM \
+                (SELECT DISTINCT ON (subreddit) subreddit, price FROM price \
+                 WHERE time > %s AND time < %s ORDER BY subreddit, time DESC) n \
+                JOIN (SELECT DISTINCT ON (subreddit) subreddit, price FROM price \
+                 WHERE time > %s AND time < %s ORDER BY subreddit, time ASC) o \
+                ON n.subreddit = o.subreddit"
+        self.cur.execute(querystr, (start, end, start, end))
+        return {row[0]: (row[1], row[2]) for row in self.cur.fetchall()}
+
     # ------------ data table ------------
 
     def data_table_exists(self):
@@ -144,6 +196,34 @@ class DatabaseConnection(object):
                           data_dict["submission_rate_1h"], data_dict["comment_rate_1h"], data_dict["mention_rate_1h"]))
         self.conn.commit()
 
+    def insert_data_many(self, data_dicts, commit=True):
+        """
+        insert a batch of data items into the table using a single transaction
+        (which is left open if commit is False)
+        """
+        rows = [(d["time"], d["hours"], d["subreddit"], d["subscribers"], d["submission_rate"],
+                 d["comment_rate"], d["mention_rate"], d["submission_rate_1h"], d["comment_rate_1h"],
+                 d["mention_rate_1h"]) for d in data_dicts]
+        psycopg2.extras.execute_values(
+            self.cur,
+            "INSERT INTO data (time, hours, subreddit, subscribers, submission_rate, comment_rate, mention_rate, submission_rate_1h, comment_rate_1h, mention_rate_1h) "
+            "VALUES %s;", rows)
+        if commit:
+            self.conn.commit()
+
+    def update_mentions(self, rows, commit=True):
+        """
+        set the mention rates of existing data items
+        rows: (subreddit, time, mention_rate, mention_rate_1h) tuples
+        """
+        psycopg2.extras.execute_values(
+            self.cur,
+            "UPDATE data SET mention_rate = v.mention_rate, mention_rate_1h = v.mention_rate_1h "
+            "FROM (VALUES %s) AS v (subreddit, time, mention_rate, mention_rate_1h) "
+            "WHERE data.subreddit = v.subreddit AND data.time = v.time;", rows)
+        if commit:
+            self.conn.commit()
+
     # ------------ data table queries------------
 
     def get_all_subreddits(self):
@@ -217,6 +297,46 @@ class DatabaseConnection(object):
         self.cur.execute(querystr, (start, end))
         return self.cur.fetchall()
 
+    def get_data_series(self, subreddits, start, end):
+        """
+        Returns all (subreddit, time, subscribers, submission_rate, comment_rate, mention_rate,
+        submission_rate_1h, comment_rate_1h, mention_rate_1h) rows in the given interval ordered
+        by subreddit and time. If subreddits is None the rows of all subreddits are returned.
+        """
+        if subreddits is None:
+            querystr = "SELECT subreddit, time, subscribers, submission_rate, comment_rate, mention_rate, \
+                    submission_rate_1h, comment_rate_1h, mention_rate_1h FROM data \
+                    WHERE time > %s AND time < %s ORDER BY subreddit, time ASC"
+            self.cur.execute(querystr, (start, end))
+        else:
+            querystr = "SELECT subreddit, time, subscribers, submission_rate, comment_rate, mention_rate, \
+                    submission_rate_1h, comment_rate_1h, mention_rate_1h FROM data \
+                    WHERE subreddit = ANY(%s) AND time > %s AND time < %s ORDER BY subreddit, time ASC"
+            self.cur.execute(querystr, (list(subreddits), start, end))
+        return self.cur.fetchall()
+
+    def get_first_last_data_in_interval(self, start, end, subreddits=None):
+        """
+        Returns the newest and the oldest metrics (subscribers, submission_rate, comment_rate, mention_rate)
+        for every subreddit (or only the given subreddits) in the given interval.
+        format: {subreddit: (newest metrics tuple, oldest metrics tuple)}
+        """
+        if subreddits is None:
+            condition = "time > %s AND time < %s"
+            args = (start, end)
+        else:
+            condition = "subreddit = ANY(%s) AND time > %s AND time < %s"
+            args = (list(subreddits), start, end)
+        querystr = "SELECT n.subreddit, n.subscribers, n.submission_rate, n.comment_rate, n.mention_rate, \
+                o.subscribers, o.submission_rate, o.comment_rate, o.mention_rate FROM \
+                (SELECT DISTINCT ON (subreddit) subreddit, subscribers, submission_rate, comment_rate, mention_rate \
+                 FROM data WHERE {0} ORDER BY subreddit, time DESC) n \
+                JOIN (SELECT DISTINCT ON (subreddit) subreddit, subscribers, submission_rate, comment_rate, mention_rate \
+                 FROM data WHERE {0} ORDER BY subreddit, time ASC) o \
+                ON n.subreddit = o.subreddit".format(condition)
+        self.cur.execute(querystr, args + args)
+        return {row[0]: (row[1:5], row[5:9]) for row in self.cur.fetchall()}
+
     def get_interpolated_data(self, subreddit, timestamp):
         """
         Returns a metrics tuple for the subreddit for the given timestamp.
@@ -255,3 +375,39 @@ class DatabaseConnection(object):
         querystr = "SELECT DISTINCT subreddit FROM data WHERE time < %s"
         self.cur.execute(querystr, (timestamp,))
         return [i[0] for i in self.cur.fetchall()]
+
+    # ------------ growth snapshot table ------------
+
+    def growth_snapshot_table_exists(self):
+        self.cur.execute("SELECT * FROM information_schema.tables where table_name=%s ;", ("growth_snapshot",))
+        return self.cur.rowcount > 0
+
+    def create_growth_snapshot_table(self):
+        """
+        create the table with the latest mean growth of each subreddit over several horizons
+        format: |subreddit|hours|time|growth|
+        """
+        self.cur.execute("CREATE TABLE growth_snapshot (subreddit varchar, hours int, time timestamp, \
+                         growth double precision, PRIMARY KEY (subreddit, hours));")
+        self.cur.execute("CREATE INDEX growth_snapshot_hours_growth_idx ON growth_snapshot (hours, growth);")
+        self.conn.commit()
+        log.info("Created growth snapshot table.")
+
+    def upsert_growth_snapshot(self, rows):
+        """
+        insert or replace (subreddit, hours, time, growth) rows
+        """
+        psycopg2.extras.execute_values(
+            self.cur,
+            "INSERT INTO growth_snapshot (subreddit, hours, time, growth) VALUES %s \
+             ON CONFLICT (subreddit, hours) DO UPDATE SET time = EXCLUDED.time, growth = EXCLUDED.growth;",
+            rows)
+        self.conn.commit()
+
+    def get_growth_snapshot(self, hours):
+        """
+        Returns the (subreddit, growth, time) rows for the given horizon ordered by growth.
+        """
+        querystr = "SELECT subreddit, growth, time FROM growth_snapshot WHERE hours=%s ORDER BY growth ASC"
+        self.cur.execute(querystr, (hours,))
+        return self.cur.fetchall()
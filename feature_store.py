@@ -0,0 +1,134 @@
+"""
+On-disk store for computed feature rows.
+
+Every row is addressed by the hash of (feature version, coin, end time).
+The rows of a version are appended to a raw float64 file which can be memory mapped,
+the keys are appended to a second file with fixed size records.
+"""
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import util
+from panel import from_us, to_us
+from settings import features as feature_settings
+
+log = util.setup_logger(__name__)
+
+KEY_DTYPE = np.dtype([("digest", "S40"), ("end", "<i8"), ("coin", "S64")])
+
+
+class FeatureStore(object):
+    """
+    Append-only store of feature rows for one feature version.
+    """
+
+    def __init__(self, version, width, path=None):
+        if path is None:
+            path = feature_settings["store_dir"]
+        self.version = version
+        self.width = width
+        self.dir = os.path.join(path, version)
+        self.rows_file = os.path.join(self.dir, "rows.f8")
+        self.keys_file = os.path.join(self.dir, "keys.bin")
+        meta_file = os.path.join(self.dir, "meta.json")
+        if not os.path.exists(self.dir):
+            os.makedirs(self.dir)
+        if os.path.exists(meta_file):
+            with open(meta_file) as f:
+                meta = json.load(f)
+            if meta["width"] != width:
+                raise ValueError("Feature store {} has width {} not {}.".format(self.dir, meta["width"], width))
+        else:
+            with open(meta_file, "w") as f:
+                json.dump({"version": version, "width": width}, f)
+        self.index = {}
+        for i, digest in enumerate(self.keys()["digest"]):
+            self.index[digest] = i
+
+    def __len__(self):
+        """
+        Number of complete rows (a row only counts if its key was written as well).
+        """
+        rows = os.path.getsize(self.rows_file) // (8 * self.width) if os.path.exists(self.rows_file) else 0
+        keys = os.path.getsize(self.keys_file) // KEY_DTYPE.itemsize if os.path.exists(self.keys_file) else 0
+        return min(rows, keys)
+
+    def __contains__(self, key):
+        coin, end = key
+        return self.digest(coin, end) in self.index
+
+    def digest(self, coin, end):
+        key = "{}|{}|{}".format(self.version, coin, to_us(end))
+        return hashlib.sha1(key.encode("utf-8")).hexdigest().encode("ascii")
+
+    def missing(self, coins, end):
+        """
+        Returns those coins (subreddits) which have no row for end.
+        """
+        return [coin for coin in coins if self.digest(coin, end) not in self.index]
+
+    def put(self, coins, end, rows):
+        """
+        Appends the rows for coins (subreddits) at end. Rows that are already stored are skipped.
+        """
+        rows = np.asarray(rows, dtype="<f8").reshape(len(coins), self.width)
+        new = [i for i, coin in enumerate(coins) if self.digest(coin, end) not in self.index]
+        if not new:
+            return 0
+        n = len(self)
+        keys = np.zeros(len(new), dtype=KEY_DTYPE)
+        for j, i in enumerate(new):
+            keys[j] = (self.digest(coins[i], end), to_us(end), coins[i].encode("utf-8"))
+        # truncate incomplete writes, then write the rows before the keys
+        for path, size in ((self.rows_file, 8 * self.width), (self.keys_file, KEY_DTYPE.itemsize)):
+            if os.path.exists(path) and os.path.getsize(path) != n * size:
+                with open(path, "r+b") as f:
+                    f.truncate(n * size)
+        with open(self.rows_file, "ab") as f:
+            f.write(rows[new].tobytes())
+        with open(self.keys_file, "ab") as f:
+            f.write(keys.tobytes())
+        for j, key in enumerate(keys):
+            self.index[key["digest"]] = n + j
+        return len(new)
+
+    def get(self, coins, end):
+        """
+        Returns the rows for coins (subreddits) at end. Raises a KeyError for missing rows.
+        """
+        idx = []
+        for coin in coins:
+            digest = self.digest(coin, end)
+            if digest not in self.index:
+                raise KeyError("No features for {} at {}.".format(coin, end))
+            idx.append(self.index[digest])
+        return np.array(self.matrix()[idx])
+
+    def matrix(self):
+        """
+        Returns all rows as a read-only memory mapped array of shape rows x width.
+        """
+        n = len(self)
+        if n == 0:
+            return np.empty((0, self.width))
+        return np.memmap(self.rows_file, dtype="<f8", mode="r", shape=(n, self.width))
+
+    def keys(self):
+        """
+        Returns the keys (digest, end in us, coin) of all rows.
+        """
+        n = len(self)
+        if n == 0:
+            return np.empty(0, dtype=KEY_DTYPE)
+        return np.memmap(self.keys_file, dtype=KEY_DTYPE, mode="r", shape=(n,))
+
+    def ends(self):
+        """
+        Returns the end times of all rows as datetimes.
+        """
+        return [from_us(e) for e in self.keys()["end"]]
@@ -0,0 +1,65 @@
+"""
+Vectorized computation of the growth features used for training and prediction.
+Computes the same values as query.averaged_interval_growth_rate for all coins at once.
+"""
+from __future__ import absolute_import, division, print_function
+
+import datetime
+
+import numpy as np
+
+import util
+from panel import Panel
+
+log = util.setup_logger(__name__)
+
+# change the version whenever the computation of the features changes
+# so that stored features are not mixed with new ones
+FEATURE_VERSION = "growth-v1"
+# subscriber, submission, comment and mention rate growth, 24h price change and future 24h price change
+FEATURE_WIDTH = 6
+
+
+def interval_growth_rates(metrics, total_hours):
+    """
+    Vectorized version of query.averaged_interval_growth_rate.
+    metrics: array of shape coins x hours x metrics with the hourly interpolated metrics.
+    Returns an array of shape coins x 4 with the subscriber, submission, comment and mention rate growth.
+    """
+    subscriber_rate = np.diff(metrics[:, :, 0], axis=1)
+    rates = [subscriber_rate, metrics[:, :, 1].copy(), metrics[:, :, 2].copy(), metrics[:, :, 3].copy()]
+    # the first entry of every rate is replaced by the clipped first subscriber rate
+    first = np.maximum(subscriber_rate[:, 0], 0)
+    growths = []
+    for rate in rates:
+        rate[:, 0] = first
+        growths.append((rate.sum(axis=1) + total_hours) / (total_hours * (rate[:, 0] + 1)))
+    return np.column_stack(growths)
+
+
+def growth_features(db, coin_name_array, end, hours=24, include_future_growth=True, skip_missing=False):
+    """
+    Computes the feature matrix of query.sub_and_price_growths with two queries.
+    Each row contains the interval growth rates in the hours before end, the 24h price change at end
+    and (if include_future_growth) the 24h price change hours after end.
+    Raises a ValueError if a value cannot be interpolated for one of the coins,
+    unless skip_missing is set, then the rows of those coins are left out.
+    """
+    start = end - datetime.timedelta(hours=hours)
+    growth_time = end + datetime.timedelta(hours=hours)
+    subreddits = [coin[-1] for coin in coin_name_array]
+    total_hours = (end - start).seconds / 3600. + (end - start).days * 24
+    data = Panel.load(db, start, end, subreddits=subreddits, tables=("data",))
+    price_end = growth_time if include_future_growth else end
+    prices = Panel.load(db, end, price_end, step=datetime.timedelta(hours=hours),
+                        subreddits=subreddits, tables=("price",)).metric("percent_change_24h").T
+    metrics = data.values.transpose(1, 0, 2)
+    missing = np.isnan(metrics).any(axis=(1, 2)) | np.isnan(prices).any(axis=1)
+    if missing.any() and skip_missing:
+        log.warning("Skipping {} coins without data for {} to {}: {}".format(
+            missing.sum(), start, end, ", ".join(subreddits[i] for i in np.flatnonzero(missing))))
+        metrics, prices = metrics[~missing], prices[~missing]
+    elif missing.any():
+        sub = subreddits[np.flatnonzero(missing)[0]]
+        raise ValueError("Cannot interpolate for given interval, subreddit: {} {} {}".format(start, end, sub))
+    return np.column_stack([interval_growth_rates(metrics, total_hours), prices])
@@ -2,13 +2,15 @@ import argparse
 import datetime
 import os
 
-import matplotlib.pyplot as plt
-
 import AutoTrader
+import query
+import regressor
 import simulator
+import snapshot
 import util
 from coinmarketcap import CoinCap
 from database import DatabaseConnection
+from pipeline import CollectPipeline
 from reddit import RedditStats
 from settings import general
 from simulator import policies
@@ -20,21 +22,20 @@ def collect(coin_name_array, hours=12):
     Collects the reddit data for the coins in coin_name_array.
     coin_name_array should be a 2D array where each row contains keywords for a crypto coin
     and the last one is the subreddit
+    Fetching and writing to the database are overlapped (see pipeline.CollectPipeline).
+    The growth_snapshot table is updated once the run is committed.
     """
-    stat = RedditStats()
     auth = util.get_postgres_auth()
     db = DatabaseConnection(**auth)
-    mentions = stat.get_mentions(coin_name_array, hours=hours,
-                                 include_submissions=True, score_scaling=True)
-    log.info("Got mentions for all subs.")
-    for i, coin_tuple in enumerate(coin_name_array):
-        subreddit = coin_tuple[-1]
-        stats_dict = stat.compile_dict(subreddit, hours=hours)
-        stats_dict["mention_rate"] = mentions[0][i]
-        stats_dict["mention_rate_1h"] = mentions[1][i]
-        db.insert_data(stats_dict)
-        log.info("Got stats for: %s" % (subreddit))
-    db.close()
+
+    def update_snapshot(records):
+        query.refresh_growth_snapshot(db, [r["subreddit"] for r in records])
+
+    try:
+        written = CollectPipeline(db, coin_name_array, hours=hours, on_batch=update_snapshot).run()
+        log.info("Collected stats for {} of {} subs.".format(written, len(coin_name_array)))
+    finally:
+        db.close()
 
 
 def collect_price(coin_name_array):
@@ -90,8 +91,18 @@ def main():
                         help="Collect subreddit information into the database.")
     parser.add_argument("--collect_price", default=False, action='store_true',
                         help="Collect coin price information into the database.")
+    parser.add_argument("--update_model", default=False, action='store_true',
+                        help="Update the online regression model with the newest labelled data.")
     parser.add_argument("--run_sim", default=False, action='store_true',
                         help="Run simulation.")
+    parser.add_argument("--plot", default=False, action='store_true',
+                        help="Plot the runs of --run_sim (requires matplotlib).")
+    parser.add_argument("--snapshot", default=None, type=str,
+                        help="Run --run_sim on a snapshot directory instead of the database.")
+    parser.add_argument("--export_snapshot", default=None, type=str,
+                        help="Export the data and price tables of the last --snapshot_days days to a directory.")
+    parser.add_argument("--snapshot_days", default=30, type=int,
+                        help="Number of days exported by --export_snapshot.")
     parser.add_argument("--find_by_symbols", default=False, action='store_true',
                         help="Find coins and subreddits using 'symbols.csv'.")
     parser.add_argument("--auto_trade", type=str, default="",
@@ -126,10 +137,36 @@ def main():
             log.warn("Collect price called but %s does not exist." % (file_path))
             log.warn("Run --find_subs first.")
 
+    if args.update_model:
+        if os.path.exists(file_path):
+            subs = util.read_subs_from_file(file_path)
+            auth = util.get_postgres_auth()
+            db = DatabaseConnection(**auth)
+            try:
+                regressor.update_online_model(db, subs)
+            finally:
+                db.close()
+        else:
+            log.warn("Update model called but %s does not exist." % (file_path))
+            log.warn("Run --find_subs first.")
+
+    if args.export_snapshot is not None:
+        auth = util.get_postgres_auth()
+        db = DatabaseConnection(**auth)
+        try:
+            end_time = datetime.datetime.utcnow()
+            snapshot.export(db, args.export_snapshot, end_time - datetime.timedelta(args.snapshot_days), end_time)
+        finally:
+            db.close()
+
     if args.run_sim:
+        paths = []
+        now = datetime.datetime.utcnow()
+        if args.snapshot is not None:
+            now = snapshot.SnapshotConnection(args.snapshot).end
         minute_offsets = range(60, 500, 43)
         for minute_offset in minute_offsets:
-            end_time = datetime.datetime.utcnow() - datetime.timedelta(minutes=minute_offset)
+            end_time = now - datetime.timedelta(minutes=minute_offset)
             start_time = end_time - datetime.timedelta(15)
             policy_list = [
                 policies.subreddit_growth_policy,
@@ -139,13 +176,13 @@ def main():
                 policies.subreddit_growth_policy_with_stagnation_detection,
                 policies.subreddit_growth_policy_with_dynamic_stagnation_detection
             ]
-            simulator.simulate(policy_list, start_time)
+            paths += simulator.simulate(policy_list, start_time, end_time=now, snapshot=args.snapshot)
         title_str = "K={}, STEP_HOURS={}, GROWTH_HOURS={}, STAGNATION_HOURS={}, STAGNATION_THRESHOLD={}"
         title_str = title_str.format(policies.K, policies.STEP_HOURS, policies.GROWTH_HOURS,
                          policies.STAGNATION_HOURS, policies.STAGNATION_THRESHOLD)
-
-        plt.title(title_str)
-        plt.show()
+        if args.plot:
+            from simulator import plot
+            plot.render(paths, title=title_str)
 
 
     if args.find_by_symbols:
@@ -0,0 +1,279 @@
+"""
+In-memory representation of the data and price tables.
+
+Series holds the raw rows of one table grouped by subreddit,
+Panel resamples them onto a regular time grid as a dense hours x coins x metrics array.
+"""
+from __future__ import absolute_import, division, print_function
+
+import datetime
+
+import numpy as np
+
+import util
+from settings import features as feature_settings
+
+log = util.setup_logger(__name__)
+
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+DATA_METRICS = ["subscribers", "submission_rate", "comment_rate", "mention_rate",
+                "submission_rate_1h", "comment_rate_1h", "mention_rate_1h"]
+PRICE_METRICS = ["price", "percent_change_1h", "percent_change_24h"]
+
+
+def to_us(timestamp):
+    """
+    Converts a (naive utc) datetime into microseconds since the epoch.
+    """
+    return (timestamp - EPOCH) // MICROSECOND
+
+
+def from_us(us):
+    """
+    Converts microseconds since the epoch into a (naive utc) datetime.
+    """
+    return EPOCH + datetime.timedelta(microseconds=int(us))
+
+
+def interpolate(times, values, at):
+    """
+    Interpolates values (sorted by times) for the timestamps at (all in us).
+    Uses the same rules as DatabaseConnection.get_interpolated_data:
+    Only strictly older and newer rows are used, if no newer row exists the older values
+    are returned and if no older row exists the result is nan.
+    """
+    at = np.asarray(at, dtype=np.int64)
+    result = np.full((len(at), values.shape[1]), np.nan)
+    newer = np.searchsorted(times, at, side="right")
+    older = np.searchsorted(times, at, side="left") - 1
+    has_newer = newer < len(times)
+    has_older = older >= 0
+    both = has_newer & has_older
+    n, o, t = newer[both], older[both], at[both]
+    interval = times[n] - times[o]
+    weight_newer = (times[n] - t) / interval
+    weight_older = (t - times[o]) / interval
+    result[both] = weight_newer[:, None] * values[n] + weight_older[:, None] * values[o]
+    only_older = has_older & ~has_newer
+    result[only_older] = values[older[only_older]]
+    return result
+
+
+def forward_fill(times, values, at):
+    """
+    Returns the values of the newest row at or before each timestamp in at (nan if there is none).
+    """
+    at = np.asarray(at, dtype=np.int64)
+    result = np.full((len(at), values.shape[1]), np.nan)
+    older = np.searchsorted(times, at, side="right") - 1
+    has_older = older >= 0
+    result[has_older] = values[older[has_older]]
+    return result
+
+
+class Series(object):
+    """
+    Raw rows of one table for several subreddits.
+    The rows of each subreddit are stored consecutively and sorted by time:
+    the rows of coins[i] are times[offsets[i]:offsets[i+1]] and values[offsets[i]:offsets[i+1]].
+    """
+
+    def __init__(self, coins, offsets, times, values, columns):
+        self.coins = list(coins)
+        self.coin_index = {c: i for i, c in enumerate(self.coins)}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.times = np.asarray(times, dtype=np.int64)
+        self.values = np.asarray(values, dtype=float)
+        self.columns = list(columns)
+        self._keys = None
+
+    @classmethod
+    def from_rows(cls, rows, columns):
+        """
+        Creates a Series from (subreddit, time, values...) rows ordered by subreddit and time
+        (see DatabaseConnection.get_data_series and get_price_series).
+        """
+        coins = []
+        offsets = [0]
+        for i, row in enumerate(rows):
+            if i == 0 or row[0] != rows[i-1][0]:
+                if i > 0:
+                    offsets.append(i)
+                coins.append(row[0])
+        offsets.append(len(rows))
+        if not rows:
+            offsets = [0]
+        times = np.array([to_us(r[1]) for r in rows], dtype=np.int64)
+        values = np.array([r[2:] for r in rows], dtype=float).reshape(len(rows), len(columns))
+        return cls(coins, offsets, times, values, columns)
+
+    @classmethod
+    def load_data(cls, db, subreddits, start, end):
+        return cls.from_rows(db.get_data_series(subreddits, start, end), DATA_METRICS)
+
+    @classmethod
+    def load_price(cls, db, subreddits, start, end):
+        return cls.from_rows(db.get_price_series(subreddits, start, end), PRICE_METRICS)
+
+    def __contains__(self, coin):
+        return coin in self.coin_index
+
+    def __len__(self):
+        return len(self.times)
+
+    def rows(self, coin):
+        """
+        Returns the times and values of all rows for coin.
+        """
+        i = self.coin_index[coin]
+        s = slice(self.offsets[i], self.offsets[i+1])
+        return self.times[s], self.values[s]
+
+    def resample(self, coin, at, fill="interpolate"):
+        """
+        Returns the values of coin at the timestamps at (in us), see interpolate and forward_fill.
+        """
+        if coin not in self.coin_index:
+            return np.full((len(at), len(self.columns)), np.nan)
+        times, values = self.rows(coin)
+        if fill == "interpolate":
+            return interpolate(times, values, at)
+        elif fill == "ffill":
+            return forward_fill(times, values, at)
+        raise ValueError("Invalid fill: {}".format(fill))
+
+    def keys(self):
+        """
+        Sort keys of all rows (coin index and time combined), used to search all coins at once.
+        """
+        if self._keys is None:
+            coin_nr = np.repeat(np.arange(len(self.coins), dtype=np.int64), np.diff(self.offsets))
+            self._tmin = self.times.min() if len(self.times) else 0
+            self._span = (self.times.max() - self._tmin + 2) if len(self.times) else 1
+            self._keys = coin_nr * self._span + (self.times - self._tmin)
+        return self._keys
+
+    def first_last(self, start, end):
+        """
+        Finds the oldest and the newest row of every coin in the interval (start, end) (both excluded, in us).
+        Returns index arrays (first, last) into times/values and a mask of the coins with rows in the interval.
+        """
+        keys = self.keys()
+        coin_nr = np.arange(len(self.coins), dtype=np.int64)
+        lo = np.clip(start - self._tmin, -1, self._span - 1)
+        hi = np.clip(end - self._tmin, 0, self._span)
+        first = np.searchsorted(keys, coin_nr * self._span + lo, side="right")
+        last = np.searchsorted(keys, coin_nr * self._span + hi, side="left") - 1
+        has_rows = last >= first
+        return first, last, has_rows
+
+
+class Panel(object):
+    """
+    Dense array of shape times x coins x metrics on a regular time grid.
+    """
+
+    def __init__(self, times, coins, metrics, values):
+        self.times = np.asarray(times, dtype=np.int64)
+        self.coins = list(coins)
+        self.metrics = list(metrics)
+        self.coin_index = {c: i for i, c in enumerate(self.coins)}
+        self.metric_index = {m: i for i, m in enumerate(self.metrics)}
+        self.values = values
+
+    @staticmethod
+    def time_grid(start, end, step=datetime.timedelta(hours=1)):
+        """
+        Returns the timestamps start, start + step, ... <= end in us.
+        """
+        return np.arange(to_us(start), to_us(end) + 1, step // MICROSECOND, dtype=np.int64)
+
+    @classmethod
+    def from_series(cls, series_list, times, coins=None, fill="interpolate"):
+        """
+        Resamples the given Series onto the grid times (in us).
+        The metrics of all series are concatenated, coins without rows are nan.
+        """
+        if coins is None:
+            coins = sorted(set(c for series in series_list for c in series.coins))
+        metrics = [m for series in series_list for m in series.columns]
+        values = np.empty((len(times), len(coins), len(metrics)))
+        col = 0
+        for series in series_list:
+            width = len(series.columns)
+            for i, coin in enumerate(coins):
+                values[:, i, col:col + width] = series.resample(coin, times, fill=fill)
+            col += width
+        return cls(times, coins, metrics, values)
+
+    @classmethod
+    def load(cls, db, start, end, step=datetime.timedelta(hours=1), subreddits=None,
+             tables=("data", "price"), fill="interpolate", margin=None):
+        """
+        Loads the given tables for the interval [start, end] on a grid with spacing step.
+        The rows are fetched with margin around the interval so that the borders can be interpolated.
+        """
+        if margin is None:
+            margin = datetime.timedelta(hours=feature_settings["interpolation_margin_hours"])
+        series_list = []
+        for table in tables:
+            if table == "data":
+                series_list.append(Series.load_data(db, subreddits, start - margin, end + margin))
+            elif table == "price":
+                series_list.append(Series.load_price(db, subreddits, start - margin, end + margin))
+            else:
+                raise ValueError("Invalid table: {}".format(table))
+        panel = cls.from_series(series_list, cls.time_grid(start, end, step), coins=subreddits, fill=fill)
+        log.info("Loaded panel with shape {}.".format(panel.values.shape))
+        return panel
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def datetimes(self):
+        return [from_us(t) for t in self.times]
+
+    def time_index(self, timestamp):
+        """
+        Index of the newest grid point at or before timestamp.
+        """
+        return int(np.searchsorted(self.times, to_us(timestamp), side="right")) - 1
+
+    def metric(self, name):
+        """
+        Returns the times x coins array of a metric.
+        """
+        return self.values[:, :, self.metric_index[name]]
+
+    def coin(self, coin):
+        """
+        Returns the times x metrics array of a coin.
+        """
+        return self.values[:, self.coin_index[coin], :]
+
+    def at(self, timestamp):
+        """
+        Returns the coins x metrics array at the newest grid point at or before timestamp.
+        """
+        return self.values[self.time_index(timestamp)]
+
+    def window(self, start, end):
+        """
+        Returns a Panel (sharing memory) with the grid points in [start, end].
+        """
+        lo = int(np.searchsorted(self.times, to_us(start), side="left"))
+        hi = int(np.searchsorted(self.times, to_us(end), side="right"))
+        return Panel(self.times[lo:hi], self.coins, self.metrics, self.values[lo:hi])
+
+    def select(self, coins=None, metrics=None):
+        """
+        Returns a Panel with a subset of the coins and/or metrics (in the given order).
+        """
+        coins = self.coins if coins is None else list(coins)
+        metrics = self.metrics if metrics is None else list(metrics)
+        ci = [self.coin_index[c] for c in coins]
+        mi = [self.metric_index[m] for m in metrics]
+        return Panel(self.times, coins, metrics, self.values[:, ci][:, :, mi])
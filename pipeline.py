@@ -0,0 +1,165 @@
+import queue
+import threading
+
+import util
+from reddit import RedditStats
+from settings import collect as collect_settings
+
+log = util.setup_logger(__name__)
+
+# marks that a fetch worker has no more records
+_DONE = object()
+
+
+class CollectPipeline(object):
+    """
+    Producer/consumer pipeline for collecting reddit data.
+    The mentions and the per subreddit stats are fetched concurrently and
+    streamed through a bounded queue to a writer which inserts them in batches while the fetching goes on.
+    The mention rates are only known at the end, they are filled in with one update before the
+    whole run is committed, so readers never see rows without mentions.
+    """
+
+    def __init__(self, db, coin_name_array, hours=12, fetch_workers=None,
+                 queue_size=None, batch_size=None, on_batch=None):
+        """
+        db: DatabaseConnection the records are written to (only used by the writer).
+        on_batch: optional callback which is called with every committed batch (its errors are only logged).
+        """
+        self.db = db
+        self.coin_name_array = coin_name_array
+        self.hours = hours
+        self.fetch_workers = fetch_workers or collect_settings["fetch_workers"]
+        self.batch_size = batch_size or collect_settings["batch_size"]
+        self.records = queue.Queue(maxsize=queue_size or collect_settings["queue_size"])
+        self.on_batch = on_batch
+        self.mentions = None
+        self.mentions_error = None
+        self.mentions_ready = threading.Event()
+        self.written = 0
+
+    def _create_stats(self, reference=None):
+        """
+        praw is not thread safe so every thread gets its own RedditStats.
+        All of them use the same time interval as the reference.
+        """
+        stat = RedditStats(hours=self.hours)
+        if reference is not None:
+            stat.default_start = reference.default_start
+            stat.default_end = reference.default_end
+        return stat
+
+    def _fetch_mentions(self, stat):
+        try:
+            self.mentions = stat.get_mentions(self.coin_name_array, hours=self.hours,
+                                              include_submissions=True, score_scaling=True)
+            log.info("Got mentions for all subs.")
+        except Exception as e:
+            log.error("Could not get mentions: %s" % (str(e)))
+            self.mentions_error = e
+        finally:
+            self.mentions_ready.set()
+
+    def _fetch_stats(self, stat, tasks):
+        try:
+            while True:
+                try:
+                    i = tasks.get_nowait()
+                except queue.Empty:
+                    break
+                subreddit = self.coin_name_array[i][-1]
+                try:
+                    stats_dict = stat.compile_dict(subreddit, hours=self.hours)
+                except Exception as e:
+                    log.warn("Could not get stats for %s: %s" % (subreddit, str(e)))
+                    continue
+                self.records.put((i, stats_dict))
+                log.info("Got stats for: %s" % (subreddit))
+        finally:
+            self.records.put(_DONE)
+
+    def _write(self, batch):
+        """
+        Inserts a batch of stats without mention rates (in the open transaction).
+        """
+        records = [stats_dict for i, stats_dict in batch]
+        for stats_dict in records:
+            stats_dict["mention_rate"] = None
+            stats_dict["mention_rate_1h"] = None
+        self.db.insert_data_many(records, commit=False)
+        self.written += len(records)
+        log.info("Inserted {} records.".format(len(records)))
+
+    def _fill_mentions(self, inserted):
+        """
+        Sets the mention rates of all inserted records and commits the run.
+        """
+        rows = []
+        for i, stats_dict in inserted:
+            stats_dict["mention_rate"] = float(self.mentions[0][i])
+            stats_dict["mention_rate_1h"] = float(self.mentions[1][i])
+            rows.append((stats_dict["subreddit"], stats_dict["time"],
+                         stats_dict["mention_rate"], stats_dict["mention_rate_1h"]))
+        if rows:
+            self.db.update_mentions(rows, commit=False)
+        self.db.commit()
+        log.info("Committed {} records.".format(len(rows)))
+
+    def _notify(self, inserted):
+        """
+        Calls on_batch with the committed records in batches. Errors are logged,
+        the records stay committed.
+        """
+        if self.on_batch is None:
+            return
+        for start in range(0, len(inserted), self.batch_size):
+            try:
+                self.on_batch([stats_dict for i, stats_dict in inserted[start:start + self.batch_size]])
+            except Exception as e:
+                log.error("on_batch failed for the records {} to {}: {}".format(
+                    start, min(start + self.batch_size, len(inserted)), str(e)))
+
+    def run(self):
+        """
+        Runs the pipeline and returns the number of written records.
+        """
+        reference = self._create_stats()
+        tasks = queue.Queue()
+        for i in range(len(self.coin_name_array)):
+            tasks.put(i)
+        threads = [threading.Thread(target=self._fetch_mentions, args=(reference,))]
+        workers = min(self.fetch_workers, max(len(self.coin_name_array), 1))
+        for _ in range(workers):
+            threads.append(threading.Thread(target=self._fetch_stats,
+                                            args=(self._create_stats(reference), tasks)))
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        # writer: inserts the records as they arrive, the bounded queue blocks the fetchers if it falls behind
+        inserted = []
+        batch = []
+        finished = 0
+        try:
+            while finished < workers:
+                item = self.records.get()
+                if item is _DONE:
+                    finished += 1
+                else:
+                    batch.append(item)
+                if batch and (len(batch) >= self.batch_size or self.records.empty() or finished == workers):
+                    self._write(batch)
+                    inserted.extend(batch)
+                    batch = []
+            self.mentions_ready.wait()
+            if self.mentions_error is not None:
+                raise RuntimeError("Could not collect mentions, dropped {} records.".format(len(inserted)))
+            self._fill_mentions(inserted)
+        except BaseException:
+            self.db.rollback()
+            self.written = 0
+            raise
+        self._notify(inserted)
+        for t in threads:
+            t.join()
+        return self.written
@@ -5,8 +5,12 @@ import time
 
 import numpy as np
 
+import correlation
+import features
 import util
-from database import DatabaseConnection
+from feature_store import FeatureStore
+from panel import DATA_METRICS, Panel, from_us, to_us
+from settings import collect as collect_settings
 from settings import general
 
 # TODO better error handling
@@ -67,28 +71,32 @@ def sub_and_price_growths(db, coin_name_array, end, hours=24, include_future_gro
     """
     Collects the average interval growths and outputs them together with
     the percentage gain of the coin in the next 24h AFTER end.
+    The features for all coins are computed at once (see features.growth_features).
     """
-    start = end - datetime.timedelta(hours=hours)
-    growth_time = end + datetime.timedelta(hours=hours)
-    data = []
-    for coin in coin_name_array:
-        row = averaged_interval_growth_rate(db, coin[-1], start, end)
-        # add growth in last 24hrs
-        row = np.append(row, db.get_interpolated_price_data(coin[-1], end)[2])
-        # add growth in next 24hrs (prediction target)
-        if include_future_growth:
-            row = np.append(row, db.get_interpolated_price_data(coin[-1], growth_time)[2])
-        log.info("{} {}".format(coin[-1], row))
-        data.append(row)
-    data = np.array(data)
-    return data
-
-def prep_training_data(db, coin_name_array, timestep, steps):
-    hour_ago = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
-    end_list = [hour_ago - timestep*i for i in range(1, steps+1)]
+    return features.growth_features(db, coin_name_array, end, hours=hours,
+                                    include_future_growth=include_future_growth)
+
+def prep_training_data(db, coin_name_array, timestep, steps, store=None):
+    """
+    Computes the training rows for the last steps end times (timestep apart) and adds them to the feature store.
+    The end times are aligned to multiples of timestep so that rows of earlier runs are reused
+    and only missing rows are computed.
+    """
+    if store is None:
+        store = FeatureStore(features.FEATURE_VERSION, features.FEATURE_WIDTH)
+    step_us = timestep // datetime.timedelta(microseconds=1)
+    hour_ago = to_us(datetime.datetime.utcnow() - datetime.timedelta(hours=1))
+    last_end = from_us(hour_ago - hour_ago % step_us)
+    end_list = [last_end - timestep*i for i in range(1, steps+1)]
     for end in end_list:
-        data = sub_and_price_growths(db, coin_name_array, end, include_future_growth=True)
-        util.export_to_csv("data.csv", data, append=True)
+        missing = store.missing([coin[-1] for coin in coin_name_array], end)
+        if not missing:
+            continue
+        missing_coins = [coin for coin in coin_name_array if coin[-1] in missing]
+        data = sub_and_price_growths(db, missing_coins, end, include_future_growth=True)
+        store.put([coin[-1] for coin in missing_coins], end, data)
+        log.info("Stored {} feature rows for {}.".format(len(missing_coins), end))
+    return store
 
 def prep_prediction_data(db, coin_name_array):
     growths = sub_and_price_growths(db, coin_name_array, datetime.datetime.utcnow(), include_future_growth=False)
@@ -104,26 +112,15 @@ def prep_prediction_data(db, coin_name_array):
     util.export_to_csv("pred.csv", preds, append=False)
 
 def percentage_price_growths(db, subreddits, start, end, sort=True):
-    price_data = db.get_all_price_data_in_interval(start, end)
+    first_last = db.get_first_last_price_in_interval(start, end)
     result = []
     for sub in subreddits:
-        # find first price
-        found_row = False
-        for row in price_data:
-            if row[0] == sub:
-                price1 = row[1]
-                found_row = True
-                break
-        if not found_row:
+        if sub not in first_last:
             log.warn("No price data for {} in interval {} to {}".format(sub, start, end))
             continue
             # raise ValueError("No price data for {} in interval {} to {}".format(sub, start, end))
-
-        # find last price
-        for row in reversed(price_data):
-            if row[0] == sub:
-                price2 = row[1]
-                break
+        # price1 is the newest, price2 the oldest price
+        price1, price2 = first_last[sub]
         result.append([sub, (price2 - price1) / price1 * 100])
     if sort:
         result = sorted(result, key=lambda subr: subr[1])
@@ -134,53 +131,75 @@ def average_growth(db, subreddits, start_time, end_time, sort=True):
     Returns the subreddit with the biggest (relative) mean growth in the last 12hrs.
     Calculates the growth for the interval timestamp - hours until timestamp.
     """
-    data_points = db.get_all_data_in_interval(start_time, end_time)
+    first_last = db.get_first_last_data_in_interval(start_time, end_time, subreddits=subreddits)
     result = []
     for sub in subreddits:
-        # find first price
-        found_row = False
-        for row in data_points:
-            if row[0] == sub:
-                metrics1 = row[1:5]
-                found_row = True
-                break
-        if not found_row:
+        if sub not in first_last:
             log.warn("No subreddit data for {} in interval {} to {}".format(sub, start_time, end_time))
             continue
             # raise ValueError("No price data for {} in interval {} to {}".format(sub, start, end))
-        # find last price
-        for row in reversed(data_points):
-            if row[0] == sub:
-                metrics2 = row[1:5]
-                break
+        metrics1, metrics2 = first_last[sub]
         result.append([sub, calc_mean_growth([metrics1, metrics2])])
     if sort:
         result = sorted(result, key=lambda subr: subr[1])
     return result
 
-def covariance(db, subreddits):
-    days = 1
-    delta = datetime.timedelta(hours=12)
-    start_time = datetime.datetime.utcnow() - datetime.timedelta(days)
-    end_time = start_time + delta
-    sub_growths = []
-    price_growths = []
-    for i in range(days):
-        sub_growths += [g[1] for g in average_growth(db, subreddits, start_time, end_time, sort=False)]
-        price_growths += [p[1] for p in percentage_price_growths(db, subreddits, start_time + delta, end_time + delta, sort=False)]
-        start_time += delta
-        end_time += delta
-    print(sub_growths)
-    print(price_growths)
-    sub_growths = np.array(sub_growths)*100
-    price_growths = np.array(price_growths)
-    arr = np.vstack((sub_growths, price_growths))
-    print(np.cov(arr))
+def refresh_growth_snapshot(db, subreddits, end_time=None, hours_list=None):
+    """
+    Recomputes the growth_snapshot rows of the given subreddits for every horizon in hours_list.
+    """
+    if end_time is None:
+        end_time = datetime.datetime.utcnow()
+    if hours_list is None:
+        hours_list = collect_settings["snapshot_hours"]
+    rows = []
+    for hours in hours_list:
+        start_time = end_time - datetime.timedelta(hours=hours)
+        for sub, growth in average_growth(db, subreddits, start_time, end_time, sort=False):
+            rows.append((sub, hours, end_time, float(growth)))
+    if rows:
+        db.upsert_growth_snapshot(rows)
+    return len(rows)
+
+def snapshot_growth(db, subreddits, hours, max_age=None):
+    """
+    Returns the same ranking as average_growth for the last hours hours
+    read from the growth_snapshot table.
+    Falls back to average_growth if the horizon is not materialized or older than max_age.
+    """
+    now = datetime.datetime.utcnow()
+    rows = db.get_growth_snapshot(hours)
+    if max_age is not None:
+        rows = [r for r in rows if r[2] >= now - max_age]
+    if not rows:
+        log.info("No recent growth snapshot for {}hrs, computing growth.".format(hours))
+        return average_growth(db, subreddits, now - datetime.timedelta(hours=hours), now)
+    subreddits = set(subreddits)
+    return [[sub, growth] for sub, growth, _ in rows if sub in subreddits]
+
+def covariance(db, subreddits, days=1, horizon=12, max_lag=48):
+    """
+    Prints the mean correlation (over all coins) of each metric's growth in the last horizon hours
+    with the price change in the next horizon hours for lags of 0 to max_lag hours.
+    Returns the coins x lags x metrics correlations (see correlation.lagged_correlations).
+    """
+    end_time = datetime.datetime.utcnow()
+    start_time = end_time - datetime.timedelta(days) - datetime.timedelta(hours=horizon + max_lag)
+    panel = Panel.load(db, start_time, end_time, subreddits=list(subreddits))
+    x, y = correlation.signals(panel, horizon)
+    corr = correlation.lagged_correlations(x, y, range(max_lag + 1))
+    mean_corr = np.nanmean(corr, axis=0)
+    print("lag " + " ".join("{:>17}".format(m) for m in DATA_METRICS))
+    for lag, row in enumerate(mean_corr):
+        print("{:3d} ".format(lag) + " ".join("{:17.4f}".format(c) for c in row))
+    return corr
 
 def main():
     # coin_name_array = util.read_subs_from_file(general["subreddit_file"])
     # coin_name_array = util.read_subs_from_file(general["binance_file"])
     coin_name_array = util.read_subs_from_file(general["poloniex_file"])
+    # imported here so that the query helpers work with a snapshot.SnapshotConnection without psycopg2
+    from database import DatabaseConnection
     auth = util.get_postgres_auth()
     db = DatabaseConnection(**auth)
     # all_subreddits = db.get_all_subreddits()
@@ -1,22 +1,31 @@
 #!/usr/bin/env python
 # encoding: utf-8
 """
-This is a mini demo of how to use numpy arrays and plot data.
+Ridge regression on the growth features.
+The whole regularization path is evaluated from one SVD of the data (and one per CV fold):
+for X = U S V^T the ridge solution is beta(lambda) = V diag(s / (s^2 + lambda)) U^T y.
 NOTE: the operators + - * / are element wise operation. If you want
 matrix multiplication use ‘‘dot‘‘ or ‘‘mdot‘‘!
 """
+import argparse
+import datetime
 import functools
+import json
+import os
 
-import matplotlib.pyplot as plt
 import numpy as np
-from mpl_toolkits.mplot3d.axes3d import Axes3D
 from numpy import dot
 from numpy.linalg import inv
 
+import features
 import util
+from feature_store import FeatureStore
+from panel import MICROSECOND, from_us, to_us
+from settings import features as feature_settings
+
+log = util.setup_logger(__name__)
 
 
-# 3D plotting
 ###############################################################################
 # Helper functions
 def mdot(*args):
@@ -30,14 +39,10 @@ def prepend_one(X):
 
 
 def quad_features(X):
-    new_row_vecs = []
-    for row_vec in X:
-        new_row_vec = row_vec.copy()
-        for i, item1 in enumerate(row_vec):
-            for item2 in row_vec[i:]:
-                new_row_vec = np.append(new_row_vec, item1 * item2)
-        new_row_vecs.append(new_row_vec)
-    return np.asarray(new_row_vecs)
+    """append all products x_i * x_j (i <= j) of the features to X."""
+    X = np.asarray(X)
+    i, j = np.triu_indices(X.shape[1])
+    return np.hstack([X, X[:, i] * X[:, j]])
 
 
 def grid2d(start, end, num=50):
@@ -49,105 +54,436 @@ def grid2d(start, end, num=50):
     return np.column_stack([X0.flatten(), X1.flatten()])
 
 
+def kfold_indices(n, k, scheme="contiguous", random_state=None, times=None, embargo_hours=None):
+    """
+    Returns k (train, test) index arrays for n samples.
+    scheme:
+        "contiguous": k consecutive test blocks of n // k samples, the remaining samples are always trained on.
+        "shuffled": like contiguous but on a random permutation of the samples.
+        "time": forward chaining for time ordered samples, fold i is trained on the blocks
+            before test block i+1 (the samples are split into k + 1 blocks).
+            If the sample times (in us, ascending) are given, the training samples less than embargo_hours
+            (default: settings) before the first test sample are dropped, as their targets overlap the test period.
+            Folds without training samples are left out.
+    """
+    if scheme == "time":
+        if embargo_hours is None:
+            embargo_hours = feature_settings["embargo_hours"]
+        embargo = datetime.timedelta(hours=embargo_hours) // MICROSECOND
+        bounds = np.linspace(0, n, k + 2).astype(int)
+        folds = []
+        for i in range(k):
+            train_end = bounds[i + 1]
+            if times is not None and train_end < n:
+                train_end = min(train_end, np.searchsorted(times, times[train_end] - embargo, side="right"))
+            if train_end == 0:
+                log.warning("Leaving out time fold {} of {}, it has no training samples.".format(i + 1, k))
+                continue
+            folds.append((np.arange(train_end), np.arange(bounds[i + 1], bounds[i + 2])))
+        return folds
+    if scheme == "contiguous":
+        idx = np.arange(n)
+    elif scheme == "shuffled":
+        idx = np.random.RandomState(random_state).permutation(n)
+    else:
+        raise ValueError("Invalid scheme: {}".format(scheme))
+    set_size = int(n / k)
+    folds = []
+    for i in range(k):
+        test = idx[i * set_size:(i + 1) * set_size]
+        train = np.concatenate([idx[:i * set_size], idx[(i + 1) * set_size:]])
+        folds.append((train, test))
+    return folds
+
+
 def split_set(k, X, y):
-    test_sets = []
-    test_values = []
     training_sets = []
     training_values = []
-    set_size = int(len(X) / k)
-    for i in range(k):
-        X_temp = list(X)
-        y_temp = list(y)
-        test_sets.append(X_temp[i * set_size:(i + 1) * set_size])
-        test_values.append(y_temp[i * set_size:(i + 1) * set_size])
-        for j in range(i * set_size, (i + 1) * set_size):
-            X_temp.pop(i * set_size)
-            y_temp.pop(i * set_size)
-        training_sets.append(X_temp)
-        training_values.append(y_temp)
+    test_sets = []
+    test_values = []
+    for train, test in kfold_indices(len(X), k):
+        training_sets.append(X[train])
+        training_values.append(y[train])
+        test_sets.append(X[test])
+        test_values.append(y[test])
     return training_sets, training_values, test_sets, test_values
 
 
-def cross_validation(k, data, values, lambda_):
-    training_sets, training_values, test_sets, test_value = split_set(
-        k, data, values)
+def cross_validation(k, data, values, lambda_, scheme="contiguous"):
     dim = data.shape[1]
     squared_error = 0
-    for i, xlist in enumerate(training_sets):
-        X = np.asarray(xlist)
+    for train, test in kfold_indices(len(data), k, scheme=scheme):
+        X = data[train]
         beta_ = mdot(
             inv(dot(X.T, X) + lambda_ * np.identity(dim)), X.T,
-            training_values[i])
-        for j, vec in enumerate(test_sets[i]):
-            squared_error += (dot(vec, beta_) - test_value[i][j])**2
+            values[train])
+        squared_error += ((dot(data[test], beta_) - values[test])**2).sum()
     return squared_error / k
 
 
+def load_training_data(return_times=False):
+    """
+    Loads the training matrix from the feature store (see query.prep_training_data) ordered by time,
+    so that forward-chaining folds never train on rows newer than the test rows.
+    Falls back to data.csv if the store is empty.
+    If return_times is set the end times of the rows (in us, None for data.csv) are returned as well.
+    """
+    store = FeatureStore(features.FEATURE_VERSION, features.FEATURE_WIDTH)
+    if len(store) > 0:
+        ends = np.asarray(store.keys())["end"]
+        order = np.argsort(ends, kind="stable")
+        data, times = np.asarray(store.matrix())[order], ends[order]
+    else:
+        data, times = np.loadtxt("data.csv", delimiter=","), None
+    if return_times:
+        return data, times
+    return data
+
+
 ###############################################################################
-# load the data
-# a)
-# data = np.loadtxt("dataLinReg2D.txt")
-# b)
-data = np.loadtxt("data.csv", delimiter=",")
-
-print("data.shape:", data.shape)
-# np.savetxt("tmp.txt", data)  # save data if you want to
-# split into features and labels
-X, y = data[:, :5], data[:, 5]
-print("X.shape:", X.shape)
-print("y.shape:", y.shape)
-
-# b)
-# X = quad_features(X)
-X = prepend_one(X)
-dim = X.shape[1]
-
-# cross_validation(5, X, y, lambda_)
-print("X.shape:", X.shape)
-# Fit model/compute optimal parameters beta
-
-# a)
-lambda_ = 0.1
-
-# c)
-h = np.linspace(-10, 10, 801)
-squared_error_cv = []
-squared_training_error = []
-optimal_lambda = h[0]
-opt_error = float('inf')
-for j in h:
-    lambda_ = 10**j
-    beta_ = mdot(inv(dot(X.T, X) + lambda_*np.identity(dim) ), X.T, y)
-    # training error on all data
-    squared_training_error.append(sum([ ( y[i] - dot(X[i], beta_) )**2 for i in range(X.shape[0])]))
-    # mean squared error from cross-validation
-    squared_error_cv.append(cross_validation(5, X, y, lambda_))
-    if squared_error_cv[-1] < opt_error:
-        optimal_lambda = lambda_
-        opt_error = squared_error_cv[-1]
-# plt.plot(h, squared_training_error, label="training error on full data")
-plt.plot(h, squared_error_cv, label="mean CV error")
-plt.legend()
-plt.show()
-# print(X)
-# print("Squared Error: ", squared_error_cv)
-print ("optimal lambda:", optimal_lambda)
-print ("best error:", opt_error)
-lambda_ = optimal_lambda
-
-beta_ = mdot(inv(dot(X.T, X) + lambda_*np.identity(dim) ), X.T, y)
-print("Optimal beta:", beta_)
-
-#prediction
-X = util.read_csv("pred.csv")
-preds = []
-for row in X:
-    x = row[1:]
-    x = np.array(x)
-    x = x.astype(float)
-    # x = quad_features([x]).flatten()
-    x = np.insert(x, 0, 1.0)
-    pred = np.dot(beta_, x)
-    preds.append([row[0], pred])
-sorted_preds = sorted(preds, key=lambda x: x[1])
-print(sorted_preds)
+# Regularization path
+def _shrinkage(s, lambdas):
+    """Returns the lambdas x components matrix s / (s^2 + lambda)."""
+    lambdas = np.asarray(lambdas, dtype=float)[:, None]
+    return s / (s**2 + lambdas)
+
+
+def ridge_path(X, y, lambdas):
+    """
+    Ridge coefficients for every lambda (shape lambdas x features).
+    Same as inv(X^T X + lambda I) X^T y for each lambda.
+    """
+    U, s, Vt = np.linalg.svd(X, full_matrices=False)
+    return dot(_shrinkage(s, lambdas) * dot(U.T, y), Vt)
+
+
+def training_error_path(X, y, lambdas):
+    """
+    Squared training error on X for every lambda.
+    """
+    U, s, Vt = np.linalg.svd(X, full_matrices=False)
+    fitted = dot(_shrinkage(s, lambdas) * s * dot(U.T, y), U.T)
+    return ((fitted - y)**2).sum(axis=1)
+
+
+def cv_error_path(X, y, lambdas, k=5, scheme="contiguous", random_state=None, times=None):
+    """
+    Cross-validation error (summed squared test error / number of folds like cross_validation) for every lambda.
+    Each training fold is decomposed once. times are the sample times used by the "time" scheme.
+    """
+    folds = kfold_indices(len(X), k, scheme=scheme, random_state=random_state, times=times)
+    squared_error = np.zeros(len(lambdas))
+    for train, test in folds:
+        U, s, Vt = np.linalg.svd(X[train], full_matrices=False)
+        coef = _shrinkage(s, lambdas) * dot(U.T, y[train])
+        preds = dot(coef, dot(X[test], Vt.T).T)
+        squared_error += ((preds - y[test])**2).sum(axis=1)
+    return squared_error / len(folds)
+
+
+def loo_error_path(X, y, lambdas):
+    """
+    Mean squared leave-one-out error for every lambda using the closed form r_i / (1 - h_ii).
+    """
+    U, s, Vt = np.linalg.svd(X, full_matrices=False)
+    hat = _shrinkage(s, lambdas) * s
+    fitted = dot(hat * dot(U.T, y), U.T)
+    leverage = dot(hat, (U**2).T)
+    return (((y - fitted) / (1 - leverage))**2).mean(axis=1)
+
+
+def gcv_error_path(X, y, lambdas):
+    """
+    Generalized cross-validation error mean(r^2) / (1 - tr(H) / n)^2 for every lambda.
+    """
+    n = X.shape[0]
+    U, s, Vt = np.linalg.svd(X, full_matrices=False)
+    hat = _shrinkage(s, lambdas) * s
+    fitted = dot(hat * dot(U.T, y), U.T)
+    return ((y - fitted)**2).mean(axis=1) / (1 - hat.sum(axis=1) / n)**2
+
+
+def select_lambda(X, y, lambdas, method="cv", k=5, scheme="contiguous", times=None):
+    """
+    Evaluates the regularization path with method ("cv", "loo" or "gcv").
+    scheme and times are used by the folds of "cv" (see kfold_indices).
+    Returns the best lambda and the errors for all lambdas.
+    """
+    if method == "cv":
+        errors = cv_error_path(X, y, lambdas, k=k, scheme=scheme, times=times)
+    elif method == "loo":
+        errors = loo_error_path(X, y, lambdas)
+    elif method == "gcv":
+        errors = gcv_error_path(X, y, lambdas)
+    else:
+        raise ValueError("Invalid method: {}".format(method))
+    best = int(np.argmin(errors))
+    return lambdas[best], errors
+
+
+###############################################################################
+# Model artifacts
+FEATURE_SETS = ["raw", "quad"]
+
+
+def expand_features(X, feature_set="raw"):
+    """
+    Builds the design matrix (with a leading one) from the raw feature matrix.
+    """
+    X = np.asarray(X, dtype=float)
+    if feature_set == "quad":
+        X = quad_features(X)
+    elif feature_set != "raw":
+        raise ValueError("Invalid feature set: {}".format(feature_set))
+    return prepend_one(X)
+
+
+class RidgeModel(object):
+    """
+    A fitted ridge regression model which can be saved to and loaded from an npz artifact.
+    """
+
+    def __init__(self, beta, lambda_, feature_set="raw", feature_version=features.FEATURE_VERSION, metadata=None):
+        self.beta = np.asarray(beta, dtype=float)
+        self.lambda_ = float(lambda_)
+        self.feature_set = feature_set
+        self.feature_version = feature_version
+        self.metadata = metadata or {}
+
+    @classmethod
+    def fit(cls, data, lambdas, feature_set="raw", method="cv", scheme="contiguous", times=None):
+        """
+        Selects lambda on the training matrix (features..., target) and fits the model with it.
+        times are the row times used by the "time" folds (see kfold_indices).
+        Returns the model and the errors for all lambdas.
+        """
+        data = np.asarray(data)
+        X = expand_features(data[:, :-1], feature_set)
+        y = data[:, -1]
+        lambda_, errors = select_lambda(X, y, lambdas, method=method, scheme=scheme, times=times)
+        beta = ridge_path(X, y, [lambda_])[0]
+        metadata = {
+            "trained_at": datetime.datetime.utcnow().isoformat(),
+            "samples": int(X.shape[0]),
+            "method": method,
+            "scheme": scheme,
+            "error": float(errors.min()),
+        }
+        return cls(beta, lambda_, feature_set=feature_set, metadata=metadata), errors
+
+    def predict(self, matrix):
+        """
+        Predicts the target for every row of the raw feature matrix.
+        """
+        return dot(expand_features(matrix, self.feature_set), self.beta)
+
+    def save(self, path=None):
+        if path is None:
+            path = feature_settings["model_file"]
+        meta = {
+            "lambda": self.lambda_,
+            "feature_set": self.feature_set,
+            "feature_version": self.feature_version,
+            "metadata": self.metadata,
+        }
+        with open(path, "wb") as f:
+            np.savez(f, beta=self.beta, meta=np.array(json.dumps(meta)))
+
+    @classmethod
+    def load(cls, path=None):
+        if path is None:
+            path = feature_settings["model_file"]
+        with np.load(path, allow_pickle=False) as artifact:
+            meta = json.loads(str(artifact["meta"]))
+            beta = artifact["beta"]
+        if meta["feature_version"] != features.FEATURE_VERSION:
+            log.warning("Model was trained on features {} but the current version is {}.".format(
+                meta["feature_version"], features.FEATURE_VERSION))
+        return cls(beta, meta["lambda"], feature_set=meta["feature_set"],
+                   feature_version=meta["feature_version"], metadata=meta["metadata"])
+
+
+_models = {}
+
+
+def predict(matrix, path=None):
+    """
+    Scores every row of the raw feature matrix with the saved model (loaded once per path).
+    """
+    if path not in _models:
+        _models[path] = RidgeModel.load(path)
+    return _models[path].predict(matrix)
+
+
+def predict_growths(db, coin_name_array, end=None, path=None):
+    """
+    Predicts the price change in the next 24h for all coins.
+    Returns a list of [subreddit, prediction] sorted by prediction.
+    """
+    if end is None:
+        end = datetime.datetime.utcnow()
+    matrix = features.growth_features(db, coin_name_array, end, include_future_growth=False)
+    preds = predict(matrix, path=path)
+    return sorted([[coin[-1], p] for coin, p in zip(coin_name_array, preds)], key=lambda x: x[1])
+
+
+###############################################################################
+# Online model
+class RecursiveRidge(object):
+    """
+    Ridge regression which is updated with one observation at a time (recursive least squares).
+    P is the inverse of lambda I + X^T X (weighted by the forgetting factor), so an update costs O(d^2).
+    With forgetting=1 the coefficients equal the ridge solution on all observations,
+    forgetting < 1 down weights older observations exponentially: the weight of everything seen before
+    is multiplied by forgetting once per update_many batch (one hour of all coins), not per row.
+    """
+
+    def __init__(self, dim, lambda_=1.0, forgetting=1.0, feature_set="raw", beta=None, P=None,
+                 observations=0, last_end=None):
+        self.feature_set = feature_set
+        size = expand_features(np.zeros((1, dim)), feature_set).shape[1]
+        self.dim = dim
+        self.lambda_ = float(lambda_)
+        self.forgetting = float(forgetting)
+        self.beta = np.zeros(size) if beta is None else np.asarray(beta, dtype=float)
+        self.P = np.identity(size) / self.lambda_ if P is None else np.asarray(P, dtype=float)
+        self.observations = observations
+        # end time of the newest observation (see update_online_model)
+        self.last_end = last_end
+
+    def update(self, x, y):
+        """
+        Adds the observation (raw feature row x, target y) without forgetting.
+        """
+        z = expand_features(np.asarray(x, dtype=float).reshape(1, self.dim), self.feature_set)[0]
+        Pz = dot(self.P, z)
+        gain = Pz / (1 + dot(z, Pz))
+        self.beta = self.beta + gain * (y - dot(z, self.beta))
+        self.P = self.P - np.outer(gain, Pz)
+        # keep P symmetric against rounding errors
+        self.P = (self.P + self.P.T) / 2
+        self.observations += 1
+
+    def update_many(self, X, y):
+        """
+        Adds a batch of observations (one hour), the older observations are down weighted once.
+        """
+        # dividing P by forgetting is the same as weighting X^T X and lambda with forgetting
+        self.P = self.P / self.forgetting
+        for x, target in zip(X, y):
+            self.update(x, target)
+
+    def predict(self, matrix):
+        return dot(expand_features(matrix, self.feature_set), self.beta)
+
+    def save(self, path=None):
+        if path is None:
+            path = feature_settings["online_model_file"]
+        meta = {
+            "dim": self.dim,
+            "lambda": self.lambda_,
+            "forgetting": self.forgetting,
+            "feature_set": self.feature_set,
+            "feature_version": features.FEATURE_VERSION,
+            "observations": self.observations,
+            "last_end": to_us(self.last_end) if self.last_end is not None else None,
+        }
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, beta=self.beta, P=self.P, meta=np.array(json.dumps(meta)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=None):
+        if path is None:
+            path = feature_settings["online_model_file"]
+        with np.load(path, allow_pickle=False) as state:
+            meta = json.loads(str(state["meta"]))
+            beta, P = state["beta"], state["P"]
+        last_end = meta["last_end"]
+        if last_end is not None:
+            last_end = from_us(last_end)
+        return cls(meta["dim"], lambda_=meta["lambda"], forgetting=meta["forgetting"],
+                   feature_set=meta["feature_set"], beta=beta, P=P,
+                   observations=meta["observations"], last_end=last_end)
+
+
+def update_online_model(db, coin_name_array, path=None, hours=24):
+    """
+    Adds the newest labelled rows (features at end and the price change hours after end) of all coins
+    to the online model. end is the last full hour for which the price hours after end has been collected.
+    All hours since the last update are added (each exactly once), a new model starts with end.
+    Does nothing if the model already contains the rows for end.
+    """
+    if path is None:
+        path = feature_settings["online_model_file"]
+    if os.path.exists(path):
+        model = RecursiveRidge.load(path)
+    else:
+        model = RecursiveRidge(features.FEATURE_WIDTH - 1, lambda_=feature_settings["online_lambda"],
+                               forgetting=feature_settings["online_forgetting"])
+    end = datetime.datetime.utcnow() - datetime.timedelta(hours=hours + 1)
+    end = end.replace(minute=0, second=0, microsecond=0)
+    if model.last_end is not None and model.last_end >= end:
+        log.info("Online model is up to date ({}).".format(model.last_end))
+        return model
+    ends = [end]
+    if model.last_end is not None:
+        missed = (end - model.last_end) // datetime.timedelta(hours=1)
+        ends = [model.last_end + datetime.timedelta(hours=h) for h in range(1, missed + 1)]
+        if len(ends) > 1:
+            log.info("Catching up {} hours since {}.".format(len(ends), model.last_end))
+    for end in ends:
+        # coins without data for this hour (new subreddits, gaps) must not block the following hours
+        data = features.growth_features(db, coin_name_array, end, hours=hours, include_future_growth=True,
+                                        skip_missing=True)
+        model.update_many(data[:, :-1], data[:, -1])
+        model.last_end = end
+        # saved after every hour so that an interrupted catch up continues where it stopped
+        model.save(path)
+        log.info("Updated online model with {} rows for {}.".format(len(data), end))
+    return model
+
+
+###############################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Ridge regression")
+    parser.add_argument("--method", default="cv", choices=["cv", "loo", "gcv"],
+                        help="How lambda is selected.")
+    parser.add_argument("--folds", default="contiguous", choices=["contiguous", "shuffled", "time"],
+                        help="Fold scheme used for cross-validation.")
+    parser.add_argument("--features", default="raw", choices=FEATURE_SETS,
+                        help="Feature set of the model.")
+    parser.add_argument("--plot", default=False, action="store_true",
+                        help="Plot the errors of the regularization path.")
+    args = parser.parse_args()
+
+    # load the data
+    data, times = load_training_data(return_times=True)
+    print("data.shape:", data.shape)
+
+    h = np.linspace(-10, 10, 801)
+    lambdas = 10**h
+    model, errors = RidgeModel.fit(data, lambdas, feature_set=args.features,
+                                   method=args.method, scheme=args.folds, times=times)
+    model.save()
+    print ("optimal lambda:", model.lambda_)
+    print ("best error:", errors.min())
+    print("Optimal beta:", model.beta)
+
+    #prediction
+    if os.path.exists("pred.csv"):
+        rows = util.read_csv("pred.csv")
+        preds = model.predict(np.array([row[1:] for row in rows], dtype=float))
+        sorted_preds = sorted([[row[0], p] for row, p in zip(rows, preds)], key=lambda x: x[1])
+        print(sorted_preds)
+
+    if args.plot:
+        import matplotlib.pyplot as plt
+        plt.plot(h, errors, label="mean {} error".format(args.method.upper()))
+        plt.legend()
+        plt.show()
+
+
+if __name__ == "__main__":
+    main()
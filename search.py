@@ -0,0 +1,142 @@
+"""
+Parallel search over feature sets, lambdas and cross-validation schemes for the ridge regressor.
+
+The training matrices are written once to memory mapped .npy files which are shared by the worker processes.
+Every worker evaluates the whole lambda path of one (feature set, scheme) combination.
+
+Usage: python search.py --output search.csv
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import concurrent.futures
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import features
+import regressor
+import util
+from feature_store import FeatureStore
+
+log = util.setup_logger(__name__)
+
+FEATURE_SETS = ["raw", "quad", "lagged", "lagged_quad"]
+SCHEMES = ["contiguous", "shuffled", "time", "loo", "gcv"]
+
+
+def lagged_rows(keys, data, lag):
+    """
+    Appends the features of the same coin lag microseconds earlier to every row.
+    Rows without an earlier row are dropped. Returns the matrix and the end times of its rows.
+    """
+    index = {}
+    for i, key in enumerate(keys):
+        index[(key["coin"], int(key["end"]))] = i
+    rows = []
+    earlier = []
+    for i, key in enumerate(keys):
+        j = index.get((key["coin"], int(key["end"]) - lag))
+        if j is not None:
+            rows.append(i)
+            earlier.append(j)
+    X = np.hstack([data[rows, :-1], data[earlier, :-1]])
+    return np.column_stack([X, data[rows, -1]]), keys["end"][rows]
+
+
+def prepare(store, directory, lag):
+    """
+    Writes the time ordered training matrices of the store and the end times of their rows to directory.
+    Returns a dict which maps the base feature sets (raw, lagged) to the (matrix, times) .npy paths.
+    """
+    keys = np.array(store.keys())
+    order = np.argsort(keys["end"], kind="stable")
+    keys = keys[order]
+    data = np.asarray(store.matrix())[order]
+    paths = {}
+    for name, (matrix, times) in (("raw", (data, keys["end"])), ("lagged", lagged_rows(keys, data, lag))):
+        paths[name] = (os.path.join(directory, name + ".npy"), os.path.join(directory, name + "_times.npy"))
+        np.save(paths[name][0], matrix)
+        np.save(paths[name][1], times)
+        log.info("Prepared {} training matrix {}.".format(name, matrix.shape))
+    return paths
+
+
+def evaluate(paths, feature_set, scheme, lambdas, k=5):
+    """
+    Worker: returns the errors of the lambda path for one combination.
+    """
+    data = np.load(paths[0], mmap_mode="r")
+    times = np.load(paths[1])
+    if len(data) < k + 1:
+        return feature_set, scheme, np.full(len(lambdas), np.nan)
+    X = regressor.expand_features(data[:, :-1], "quad" if feature_set.endswith("quad") else "raw")
+    y = np.asarray(data[:, -1])
+    if scheme in ("loo", "gcv"):
+        _, errors = regressor.select_lambda(X, y, lambdas, method=scheme)
+    else:
+        # shuffled folds use a fixed seed so that the results are reproducible
+        errors = regressor.cv_error_path(X, y, lambdas, k=k, scheme=scheme, random_state=0, times=times)
+        # convert to the mean squared error per test sample like loo and gcv
+        folds = regressor.kfold_indices(len(X), k, scheme=scheme, times=times)
+        errors = errors * len(folds) / sum(len(test) for _, test in folds)
+    return feature_set, scheme, errors
+
+
+def run_search(store, lambdas, feature_sets=None, schemes=None, lag_hours=24, workers=None, k=5):
+    """
+    Evaluates all combinations in a process pool.
+    Returns the rows (feature_set, scheme, lambda, mean squared error) of the best lambda
+    of each combination ranked by error.
+    """
+    if feature_sets is None:
+        feature_sets = FEATURE_SETS
+    if schemes is None:
+        schemes = SCHEMES
+    lambdas = np.asarray(lambdas, dtype=float)
+    directory = tempfile.mkdtemp(prefix="search")
+    try:
+        paths = prepare(store, directory, lag_hours * 3600 * 10**6)
+        results = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(evaluate, paths["lagged" if fs.startswith("lagged") else "raw"], fs, scheme, lambdas, k)
+                       for fs in feature_sets for scheme in schemes]
+            for future in concurrent.futures.as_completed(futures):
+                feature_set, scheme, errors = future.result()
+                if np.all(np.isnan(errors)):
+                    log.warning("Not enough data for {} {}.".format(feature_set, scheme))
+                    continue
+                best = int(np.nanargmin(errors))
+                results.append((feature_set, scheme, float(lambdas[best]), float(errors[best])))
+                log.info("{} {}: lambda={} error={}".format(feature_set, scheme, lambdas[best], errors[best]))
+    finally:
+        shutil.rmtree(directory)
+    return sorted(results, key=lambda r: r[3])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regressor hyperparameter search")
+    parser.add_argument("--lambdas", nargs=3, type=float, default=[-10, 10, 201], metavar=("MIN", "MAX", "NUM"),
+                        help="Exponents of the lambda grid (10**linspace(MIN, MAX, NUM)).")
+    parser.add_argument("--features", nargs="+", default=FEATURE_SETS, choices=FEATURE_SETS)
+    parser.add_argument("--schemes", nargs="+", default=SCHEMES, choices=SCHEMES)
+    parser.add_argument("--lag_hours", type=int, default=24,
+                        help="Distance of the lagged features.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes (default: all cores).")
+    parser.add_argument("--output", default="search.csv")
+    args = parser.parse_args()
+
+    lambdas = 10**np.linspace(args.lambdas[0], args.lambdas[1], int(args.lambdas[2]))
+    store = FeatureStore(features.FEATURE_VERSION, features.FEATURE_WIDTH)
+    results = run_search(store, lambdas, feature_sets=args.features, schemes=args.schemes,
+                         lag_hours=args.lag_hours, workers=args.workers)
+    util.export_to_csv(args.output, [("feature_set", "scheme", "lambda", "error")] + results)
+    for r in results:
+        print("{:12} {:10} {:12.4g} {:12.6g}".format(*r))
+
+
+if __name__ == "__main__":
+    main()
@@ -20,13 +20,50 @@ reddit = dict(
                   "cryptowallstreet", "darknetmarkets", "altcoin"]
 )
 
+#collector settings
+collect = dict(
+    # number of threads fetching subreddit stats
+    fetch_workers=4,
+    # max number of fetched records waiting to be written
+    queue_size=32,
+    # number of records written per transaction
+    batch_size=16,
+    # horizons (in hours) of the growth_snapshot table which is updated after each collection run
+    snapshot_hours=[12, 24]
+)
+
+#feature settings
+features = dict(
+    # series are fetched with this margin around the interval so that
+    # the values at the interval borders can be interpolated
+    interpolation_margin_hours=6,
+    store_dir=os.path.join(filedir, "feature_store"),
+    model_file=os.path.join(filedir, "model.npz"),
+    # the time ordered cross-validation folds drop the training rows of the last hours before every test fold,
+    # their targets (the price change in the next 24h) overlap the test period
+    embargo_hours=24,
+    # recursive least squares model updated after each collection run
+    online_model_file=os.path.join(filedir, "online_model.npz"),
+    online_lambda=1.0,
+    # older observations are down weighted by this factor once per hourly update,
+    # 0.999 corresponds to a half-life of about 29 days (log(0.5) / log(0.999) = 693 hours)
+    online_forgetting=0.999
+)
+
 #simulator settings
 simulator = dict(
     scale_spendings=False,
     k=4,
     step_hours=33,
     growth_hours=12,
-    use_smoothing=True
+    use_smoothing=True,
+    # equity curves and trades of every run are written to this directory (see simulator.output)
+    output_dir=os.path.join(filedir, "runs"),
+    # number of rankings kept by the signal cache (see simulator.signals)
+    signal_cache_size=1024,
+    # simulations with a checkpoint path (e.g. checkpoints/<name>.npz) save their state
+    # every checkpoint_steps steps (see simulator.checkpoint)
+    checkpoint_steps=50
 )
 
 #autotrader settings
@@ -40,5 +77,8 @@ autotrade = dict(
     never_sell=["BNB", "XRB", "NANO"],
     use_dynamic_stagnation_detection=True,
     dynamic_top_nr=20,
+    # read the growth ranking from the growth_snapshot table if it is not older than snapshot_max_age_hours
+    use_growth_snapshot=True,
+    snapshot_max_age_hours=2,
     dry_run=False
 )
@@ -4,9 +4,12 @@ from __future__ import print_function
 
 
 from database import DatabaseConnection
+from panel import Series, to_us
+from settings import features as feature_settings
 import numpy as np
 import argparse
 import datetime
+import time
 import util
 
 
@@ -23,35 +26,69 @@ def calc_mean_growth(features_old, features_new):
             growths.append((fnew-fold)/fold)
     return np.mean(growths)
 
-def get_growths(db, subreddits, end_time, hours):
-    reference_time = end_time - datetime.timedelta(hours=hours)
-
-    growths = []
-    for subr in subreddits:
-        reference_data = db.get_interpolated_data(subr, reference_time)
-        end_data = db.get_interpolated_data(subr, end_time)
-        growth = calc_mean_growth(features_old=reference_data, features_new=end_data)
-        growths.append((subr, growth))
+def calc_mean_growths(features_old, features_new):
+    """
+    Vectorized calc_mean_growth for arrays of shape subreddits x features.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growths = (features_new - features_old) / features_old
+        growths[(features_old == 0) & (features_new == 0)] = 0
+        # features which were 0 and are not 0 anymore are ignored
+        used = (features_old != 0) | (features_new == 0)
+        return np.where(used, growths, 0).sum(axis=1) / used.sum(axis=1)
 
-    sorted_growths = sorted(growths, key=lambda subr: subr[1])
-    return sorted_growths
+def get_growths(db, end_time, hours, subreddits=None):
+    """
+    Returns the mean growth of all subreddits (or only the given subreddits) between
+    end_time - hours and end_time sorted by growth.
+    All rows are fetched with a single query, values are interpolated like get_interpolated_data.
+    Subreddits without data shortly before the reference time are skipped.
+    """
+    reference_time = end_time - datetime.timedelta(hours=hours)
+    margin = datetime.timedelta(hours=feature_settings["interpolation_margin_hours"])
+    series = Series.load_data(db, subreddits, reference_time - margin, end_time + margin)
+    times = [to_us(reference_time), to_us(end_time)]
+    subs = []
+    reference_data = []
+    end_data = []
+    for subr in series.coins:
+        values = series.resample(subr, times)
+        if np.isnan(values).any():
+            continue
+        subs.append(subr)
+        reference_data.append(values[0])
+        end_data.append(values[1])
+    if not subs:
+        return []
+    growths = calc_mean_growths(np.array(reference_data), np.array(end_data))
+    return sorted(zip(subs, growths), key=lambda subr: subr[1])
 
 
 def main():
     parser = argparse.ArgumentParser(description="Simple Query")
     parser.add_argument('hours', metavar='h', type=float)
+    parser.add_argument('--watch', metavar='N', type=float, default=0,
+                        help="Refresh the growths every N minutes.")
     args = parser.parse_args()
 
     auth = util.get_postgres_auth()
     db = DatabaseConnection(**auth)
 
-    cur_utc = datetime.datetime.utcnow()
-    subreddits = db.get_subreddits_with_data(cur_utc-datetime.timedelta(hours=args.hours))
-
-    growths = get_growths(db, subreddits, datetime.datetime.utcnow(), args.hours)
-    for g in growths:
-        print(g)
-    db.close()
+    try:
+        while True:
+            now = datetime.datetime.utcnow()
+            growths = get_growths(db, now, args.hours)
+            if args.watch > 0:
+                print("------ {} ------".format(now))
+            for g in growths:
+                print(g)
+            if args.watch <= 0:
+                break
+            time.sleep(args.watch * 60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.close()
 
 
 if __name__ == "__main__":
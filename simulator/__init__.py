@@ -1,94 +1,90 @@
 import datetime
 
-import matplotlib.pyplot as plt
 import numpy as np
 
-import database
 import simulator.policies
 import util
+from settings import simulator as simulator_settings
+from simulator import signals
+from simulator.checkpoint import load_checkpoint
+from simulator.clock import Clock
 from simulator.market import Market, Trader
+from simulator.metrics import returns
+from simulator.output import run_path, save_run
+from simulator.simulation import Simulator
+from snapshot import connect
 
 log = util.setup_logger(__name__)
 
-class Simulator(object):
-
-    def __init__(self, trader, start_time, end_time = datetime.datetime.utcnow(),
-               market=None, verbose=True):
-        if market is None:
-            self.market = Market()
-        else:
-            self.market = market
-        self.trader = trader
-        self.start_time = start_time
-        self.end_time = end_time
-        self.time = start_time
-        self.verbose = verbose
-        self.networth_history = []
-        self.date_history = []
-
-    def simulation_step(self):
-        port_val = self.market.portfolio_value()
-        self.networth_history.append(self.trader.funds + port_val)
-        self.date_history.append(self.time)
-        if self.verbose:
-            log.info("------Time: {}".format(self.time))
-            log.info("Coin value: {:8.2f}".format(port_val))
-            log.info("funds: {:13.2f}".format(self.trader.funds))
-            log.info("Sum: {:15.2f}".format(self.trader.funds + port_val))
-        self.time += self.trader.policy(self.trader, self.time, self.steps)
-        self.steps += 1
-
-    def run(self):
-        log.info("Running simulator...")
-        self.steps = 0
-        while self.time < self.end_time:
-            self.simulation_step()
+def average_percentage_gain(networth_history):
+    return np.mean(returns(networth_history) * 100)
 
-        self.market.sell_all()
-        self.networth_history.append(self.trader.funds)
-        self.date_history.append(self.time)
-        log.info("Simulation finished:")
-        log.info("Ran {} steps from {} to {}.".format(self.steps, self.start_time, self.time))
-        log.info("Trader finished with {:8.2f}.".format(self.trader.funds))
+def run_policy(db, policy, start_time, end_time, params=None, market=None, start_funds=100., verbose=False,
+               checkpoint_path=None):
+    """
+    Runs a single simulation of policy with the given parameters and returns the finished Simulator.
+    Uses a binance market if no market is given.
+    """
+    if market is None:
+        market = Market.create_binance_market(db)
+    market.verbose = verbose
+    trader = Trader(db, start_funds, market, params=params)
+    trader.policy = policy
+    sim = Simulator(trader, start_time, end_time=end_time, market=market, verbose=verbose,
+                    checkpoint_path=checkpoint_path)
+    market.setSimulator(sim)
+    market.setTrader(trader)
+    sim.run()
+    return sim
 
-def average_percentage_gain(networth_history):
-    gains = []
-    for i in range(1, len(networth_history)):
-        gains.append((networth_history[i] - networth_history[i - 1]) / networth_history[i - 1])
-    gains = np.array(gains) * 100
-    print(gains)
-    return np.mean(gains)
+def resume_policy(db, checkpoint_path, policy=None, market=None, verbose=False):
+    """
+    Continues a simulation started by run_policy with a checkpoint_path and returns the finished Simulator.
+    The policy is looked up by the name stored in the checkpoint if it is not given.
+    """
+    state = load_checkpoint(checkpoint_path)
+    if policy is None:
+        policy = getattr(simulator.policies, state["policy"])
+    if market is None:
+        market = Market(db, coins=[[c] for c in state["coins"]], fees=state["fees"])
+    market.verbose = verbose
+    trader = Trader(db, state["funds"], market)
+    trader.policy = policy
+    sim = Simulator(trader, state["start_time"], end_time=state["end_time"], market=market, verbose=verbose,
+                    checkpoint_path=checkpoint_path)
+    market.setSimulator(sim)
+    market.setTrader(trader)
+    sim.resume(checkpoint_path)
+    return sim
 
-def simulate(policy_list, start_time, end_time=datetime.datetime.utcnow()):
+def simulate(policy_list, start_time, end_time=datetime.datetime.utcnow(), output_dir=None, snapshot=None):
     """
     Function which sets up and runs the simulator.
+    Every run is written to output_dir (see simulator.output), returns the paths of the written runs.
+    Reads the data from the snapshot directory (see snapshot.export) instead of the database if given.
     """
-    auth = util.get_postgres_auth()
-    db = database.DatabaseConnection(**auth)
+    if output_dir is None:
+        output_dir = simulator_settings["output_dir"]
+    db = connect(snapshot)
+    # the cached rankings belong to the previous data source, this also resets the hit rate of the run
+    signals.cache.clear()
     avg_percentage_gains = {}
-    color_dict = {
-        "subreddit_growth_policy": "b",
-        "subreddit_growth_policy_with_stagnation_detection": "r",
-        "hybrid_policy": "g",
-        "largest_xhr_policy": "orange",
-        "subreddit_growth_policy_with_dynamic_stagnation_detection": "yellow"
-    }
-    handles = []
+    # all policies are simulated in one pass
+    clock = Clock(db)
+    simulators = []
     for policy in policy_list:
+        # market = Market(clock.db)
+        market = Market.create_binance_market(clock.db)
+        # market = Market.create_poloniex_market(clock.db)
+        # market = Market.create_bittrex_market(clock.db)
+        simulators.append(clock.add(policy, start_time, end_time, market=market, verbose=True))
+    clock.run()
+    signals.log_stats()
+    paths = []
+    for policy, sim in zip(policy_list, simulators):
         log.info("------ {} ------".format(policy.__name__))
-        start_funds = 100.
-        # market = Market(db)
-        market = Market.create_binance_market(db)
-        # market = Market.create_poloniex_market(db)
-        # market = Market.create_bittrex_market(db)
-        trader = Trader(db, start_funds, market)
-        trader.policy = policy
-        sim = Simulator(trader, start_time, end_time=end_time, market=market)
-        market.setSimulator(sim)
-        market.setTrader(trader)
-        sim.run()
         avg_percentage_gains[policy.__name__] = average_percentage_gain(sim.networth_history)
-        plot, = plt.plot_date(sim.date_history, sim.networth_history, "-", label=policy.__name__, color=color_dict[policy.__name__])
-        handles.append(plot)
-    plt.legend(handles=handles)
-    print(avg_percentage_gains)
+        paths.append(save_run(run_path(output_dir, policy.__name__, start_time), sim, name=policy.__name__))
+    db.close()
+    log.info("Average percentage gains: {}".format(avg_percentage_gains))
+    return paths
@@ -0,0 +1,243 @@
+"""
+Vectorized backtesting of the rebalancing policies (subreddit growth, largest x hr and hybrid).
+
+All parameter combinations are simulated at once on series which are loaded once.
+The results are identical to simulator.Simulator with the same policy and parameters:
+the rankings use the first/last rows of the intervals, the prices are interpolated like
+DatabaseConnection.get_interpolated_price_data and all float operations are done in the same order.
+This only holds if the price data has no gaps longer than interpolation_margin_hours at the borders
+of the loaded range (see MarketData.load), rows outside of it are not used for interpolation.
+"""
+import datetime
+import itertools
+
+import numpy as np
+
+import settings
+import util
+from panel import Series, interpolate, to_us
+from settings import features as feature_settings
+from simulator.market import portfolio_value
+
+log = util.setup_logger(__name__)
+
+POLICIES = ["subreddit_growth_policy", "largest_xhr_policy", "hybrid_policy"]
+
+
+def parameter_grid(policies=POLICIES, k=(settings.simulator["k"],),
+                   step_hours=(settings.simulator["step_hours"],),
+                   growth_hours=(settings.simulator["growth_hours"],),
+                   scale_spendings=(settings.simulator["scale_spendings"],),
+                   use_smoothing=(settings.simulator["use_smoothing"],)):
+    """
+    Returns a list with a parameter dict for every combination of the given values.
+    """
+    return [dict(policy=p, k=kk, step_hours=s, growth_hours=g, scale_spendings=sc, use_smoothing=sm)
+            for p, kk, s, g, sc, sm in itertools.product(policies, k, step_hours, growth_hours,
+                                                          scale_spendings, use_smoothing)]
+
+
+class MarketData(object):
+    """
+    The data and price series of the coins of a market.
+    """
+
+    def __init__(self, coins, data, price, fees=0):
+        self.coins = list(coins)
+        self.data = data
+        self.price = price
+        self.fees = fees
+        # position of every market coin in the series (-1 if it has no rows)
+        self.data_idx = np.array([data.coin_index.get(c, -1) for c in self.coins])
+        self.price_idx = np.array([price.coin_index.get(c, -1) for c in self.coins])
+
+    @classmethod
+    def load(cls, db, market, start_time, end_time, max_growth_hours, max_step_hours, margin=None):
+        """
+        Loads the series needed to backtest from start_time to end_time in one query per table.
+        market is a simulator.market.Market which defines the coins (in portfolio order) and the fees.
+        The last step of a simulation ends up to max_step_hours after end_time.
+        """
+        if margin is None:
+            margin = datetime.timedelta(hours=feature_settings["interpolation_margin_hours"])
+        coins = list(market.portfolio.keys())
+        first = start_time - datetime.timedelta(hours=max_growth_hours) - margin
+        last = end_time + datetime.timedelta(hours=max_step_hours) + margin
+        data = Series.load_data(db, coins, first, last)
+        price = Series.load_price(db, coins, first, last)
+        return cls(coins, data, price, fees=market.fees)
+
+    def prices(self, times):
+        """
+        Interpolated prices (times x coins) at the timestamps times (in us), nan if there is no older row.
+        """
+        result = np.full((len(times), len(self.coins)), np.nan)
+        for i, coin in enumerate(self.coins):
+            if coin in self.price:
+                t, v = self.price.rows(coin)
+                result[:, i] = interpolate(t, v[:, :1], times)[:, 0]
+        return result
+
+    def _first_last(self, series, idx, start, end, columns):
+        """
+        Newest and oldest values of columns for every market coin in (start, end) and the mask of coins with rows.
+        """
+        first, last, has_rows = series.first_last(start, end)
+        valid = idx >= 0
+        has = np.zeros(len(self.coins), dtype=bool)
+        has[valid] = has_rows[idx[valid]]
+        newest = np.zeros((len(self.coins), len(columns)))
+        oldest = np.zeros((len(self.coins), len(columns)))
+        newest[has] = series.values[last[idx[has]]][:, columns]
+        oldest[has] = series.values[first[idx[has]]][:, columns]
+        return newest, oldest, has
+
+    def subreddit_growths(self, start, end):
+        """
+        query.average_growth for all coins: the values and the mask of coins with data.
+        """
+        newest, oldest, has = self._first_last(self.data, self.data_idx, start, end, [0, 1, 2, 3])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            growths = (newest - oldest) / oldest
+        growths[(newest == 0) & (oldest == 0)] = 0
+        used = (oldest != 0) | (newest == 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(used, growths, 0.).sum(axis=1) / used.sum(axis=1), has
+
+    def price_growths(self, start, end):
+        """
+        query.percentage_price_growths for all coins: the values and the mask of coins with data.
+        """
+        newest, oldest, has = self._first_last(self.price, self.price_idx, start, end, [0])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (oldest[:, 0] - newest[:, 0]) / newest[:, 0] * 100, has
+
+    def ranking(self, policy, start, end):
+        """
+        The coin indices and values in the order the policy buys them (largest first).
+        """
+        if policy == "subreddit_growth_policy":
+            values, has = self.subreddit_growths(start, end)
+        elif policy == "largest_xhr_policy":
+            values, has = self.price_growths(start, end)
+        elif policy == "hybrid_policy":
+            growths, has_growth = self.subreddit_growths(start, end)
+            gains, has_gain = self.price_growths(start, end)
+            # combined in the order of ascending subreddit growth
+            idx = np.flatnonzero(has_growth & has_gain)
+            idx = idx[np.argsort(growths[idx], kind="stable")]
+            combined = ((growths[idx] * 100. - 100.) * 0.2 + gains[idx] * 0.8) / 1.0
+            order = idx[np.argsort(combined, kind="stable")][::-1]
+            values = np.zeros(len(self.coins))
+            values[idx] = combined
+            return order, values[order]
+        else:
+            raise ValueError("Invalid policy: {}".format(policy))
+        idx = np.flatnonzero(has)
+        order = idx[np.argsort(values[idx], kind="stable")][::-1]
+        return order, values[order]
+
+
+def _run_group(market_data, combos, start_time, end_time):
+    """
+    Simulates combos which share the step size.
+    """
+    n = len(combos)
+    step = datetime.timedelta(hours=combos[0]["step_hours"])
+    times = []
+    time = start_time
+    while time < end_time:
+        times.append(time)
+        time += step
+    final_time = time
+    times_us = np.array([to_us(t) for t in times] + [to_us(final_time)], dtype=np.int64)
+    prices = market_data.prices(times_us)
+    fee_factor = 1 - market_data.fees
+
+    k = np.array([c["k"] for c in combos])
+    kmax = int(k.max())
+    scale = np.array([c["scale_spendings"] for c in combos])
+    smoothing = np.array([c["use_smoothing"] for c in combos])
+    signals = sorted(set((c["policy"], c["growth_hours"]) for c in combos))
+    signal_id = np.array([signals.index((c["policy"], c["growth_hours"])) for c in combos])
+    col = np.arange(kmax)
+
+    funds = np.full(n, 100.)
+    held = np.full((n, kmax), -1)       # coin index, sorted by coin index
+    balance = np.zeros((n, kmax))
+    failed = np.zeros(n, dtype=bool)
+    networth = np.empty((n, len(times) + 1))
+
+    for step_nr, t in enumerate(times):
+        # portfolio_value and sell_all go through the held coins in portfolio order
+        p, valid = prices[step_nr][np.maximum(held, 0)], held >= 0
+        port_val = np.array([portfolio_value(p[i, valid[i]], balance[i, valid[i]]) for i in range(n)])
+        networth[:, step_nr] = funds + port_val
+        if step_nr > 0:
+            for j in range(kmax):
+                funds = funds + np.where(valid[:, j], fee_factor * balance[:, j] * p[:, j], 0.)
+            held[:] = -1
+            balance[:] = 0.
+        failed |= ~np.isfinite(networth[:, step_nr])
+
+        # rankings are shared by all combos with the same policy and growth hours
+        ranked = np.full((n, kmax), -1)
+        ranked_values = np.zeros((n, kmax))
+        for s, (policy, growth_hours) in enumerate(signals):
+            order, values = market_data.ranking(policy, to_us(t - datetime.timedelta(hours=growth_hours)), to_us(t))
+            rows = signal_id == s
+            m = min(kmax, len(order))
+            ranked[rows, :m] = order[:m]
+            ranked_values[rows, :m] = values[:m]
+        in_k = col[None, :] < k[:, None]
+        failed |= ((ranked < 0) & in_k).any(axis=1)
+
+        # spendings
+        last = ranked_values[np.arange(n), k - 1]
+        smooth = scale & smoothing & (last < 0)
+        shifted = np.where(smooth[:, None], ranked_values + (-last + 1)[:, None], ranked_values)
+        value_sum = np.zeros(n)
+        for j in range(kmax):
+            value_sum = value_sum + np.where(in_k[:, j], shifted[:, j], 0.)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scaled_spend = np.trunc(shifted / value_sum[:, None] * funds[:, None] * 100) / 100.
+        equal_spend = np.trunc((funds / k) * 100) / 100.
+        spend = np.where(scale[:, None], scaled_spend, equal_spend[:, None])
+        buy_price = prices[step_nr][np.maximum(ranked, 0)]
+        for j in range(kmax):
+            buying = in_k[:, j] & ~failed & ~(scale & (spend[:, j] == 0))
+            failed |= buying & ((funds < spend[:, j]) | (spend[:, j] <= 0) | np.isnan(buy_price[:, j]))
+            buying &= ~failed
+            funds = np.where(buying, funds - spend[:, j], funds)
+            balance[:, j] = np.where(buying, spend[:, j] * fee_factor / buy_price[:, j], 0.)
+            held[:, j] = np.where(buying, ranked[:, j], -1)
+        order = np.argsort(np.where(held >= 0, held, np.iinfo(held.dtype).max), axis=1, kind="stable")
+        held = np.take_along_axis(held, order, axis=1)
+        balance = np.take_along_axis(balance, order, axis=1)
+
+    # sell everything at the end
+    p, valid = prices[-1][np.maximum(held, 0)], held >= 0
+    for j in range(kmax):
+        funds = funds + np.where(valid[:, j], fee_factor * balance[:, j] * p[:, j], 0.)
+    networth[:, -1] = funds
+    failed |= ~np.isfinite(funds)
+    networth[failed] = np.nan
+    return networth, times + [final_time], failed
+
+
+def backtest(market_data, combos, start_time, end_time):
+    """
+    Simulates every parameter combination (see parameter_grid) from start_time to end_time.
+    Returns a result dict per combination with the networth_history and date_history of
+    the corresponding simulator run. Combinations whose step simulation would raise an error
+    (e.g. insufficient funds or missing prices) have failed=True and nan networths.
+    """
+    results = [None] * len(combos)
+    for step_hours in sorted(set(c["step_hours"] for c in combos)):
+        idx = [i for i, c in enumerate(combos) if c["step_hours"] == step_hours]
+        networth, dates, failed = _run_group(market_data, [combos[i] for i in idx], start_time, end_time)
+        for row, i in enumerate(idx):
+            results[i] = dict(params=combos[i], networth_history=networth[row], date_history=dates,
+                              failed=bool(failed[row]))
+    log.info("Backtested {} parameter combinations.".format(len(combos)))
+    return results
@@ -0,0 +1,134 @@
+"""
+Checkpoints of running simulations.
+
+A checkpoint is an .npz file with the histories, the portfolio and the trades as arrays and the remaining
+state (time, step count, funds, metrics, state of the policy like bought_time) as a JSON blob.
+Floats are stored exactly, so a resumed simulation produces the same results as an uninterrupted one.
+"""
+from __future__ import absolute_import, division, print_function
+
+import datetime
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import util
+from panel import from_us, to_us
+
+log = util.setup_logger(__name__)
+
+VERSION = 1
+
+# trader attributes which are not policy state
+TRADER_ATTRIBUTES = ("db", "market", "policy", "funds", "params")
+
+
+def _encode(value):
+    """
+    Converts datetimes (also in lists and dicts) into JSON compatible values.
+    """
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": to_us(value)}
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if "__datetime__" in value:
+            return from_us(value["__datetime__"])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def save_checkpoint(path, sim):
+    """
+    Writes the state of a running Simulator to path (.npz). The file is replaced atomically,
+    so an interrupted write leaves the previous checkpoint intact.
+    """
+    trader = sim.trader
+    market = sim.market
+    state = dict(version=VERSION, policy=getattr(trader.policy, "__name__", None),
+                 start_time=to_us(sim.start_time), end_time=to_us(sim.end_time), time=to_us(sim.time),
+                 steps=sim.steps, funds=trader.funds, params=trader.params, fees=market.fees,
+                 volume=market.volume, fees_paid=market.fees_paid,
+                 trader={k: v for k, v in vars(trader).items() if k not in TRADER_ATTRIBUTES},
+                 metrics=vars(sim.metrics))
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f,
+                     state=np.array(json.dumps(_encode(state))),
+                     coins=np.array(market.portfolio.coins),
+                     balances=market.portfolio.balances,
+                     prices=market.portfolio.prices,
+                     dates=np.array([to_us(d) for d in sim.date_history], dtype=np.int64),
+                     networth=np.array(sim.networth_history, dtype=float),
+                     trades=market.ledger.records())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    log.debug("Wrote checkpoint of step {} to {}.".format(sim.steps, path))
+    return path
+
+
+def load_checkpoint(path):
+    """
+    Reads a checkpoint written by save_checkpoint. Returns the state dict with the arrays added.
+    """
+    with np.load(path) as f:
+        state = _decode(json.loads(str(f["state"])))
+        if state["version"] != VERSION:
+            raise ValueError("Unsupported checkpoint version {} in {}.".format(state["version"], path))
+        state["coins"] = [str(c) for c in f["coins"]]
+        for key in ("balances", "prices", "trades"):
+            state[key] = f[key]
+        state["date_history"] = [from_us(d) for d in f["dates"]]
+        state["networth_history"] = [float(n) for n in f["networth"]]
+    for key in ("start_time", "end_time", "time"):
+        state[key] = from_us(state[key])
+    return state
+
+
+def restore(sim, state):
+    """
+    Puts a Simulator (with trader and market set up for the same coins) into the checkpointed state.
+    """
+    trader = sim.trader
+    market = sim.market
+    if market.portfolio.coins != state["coins"]:
+        raise ValueError("The market coins do not match the coins of the checkpoint.")
+    sim.start_time = state["start_time"]
+    sim.end_time = state["end_time"]
+    sim.time = state["time"]
+    sim.steps = state["steps"]
+    sim.date_history = state["date_history"]
+    sim.networth_history = state["networth_history"]
+    vars(sim.metrics).update(state["metrics"])
+    trader.funds = state["funds"]
+    trader.params = state["params"]
+    for key, value in state["trader"].items():
+        setattr(trader, key, value)
+    market.portfolio.balances[:] = state["balances"]
+    market.portfolio.prices[:] = state["prices"]
+    market.volume = state["volume"]
+    market.fees_paid = state["fees_paid"]
+    trades = state["trades"]
+    market.ledger._data = np.zeros(max(len(trades), 1) * 2, dtype=trades.dtype)
+    market.ledger._data[:len(trades)] = trades
+    market.ledger._n = len(trades)
@@ -0,0 +1,109 @@
+"""
+Event driven simulation of several traders in one pass.
+
+Every simulator is woken at the time its policy asked for; simulators which are woken at the same time
+share the price and interval lookups of that timestamp.
+"""
+import heapq
+
+import util
+from simulator.market import Market, Trader
+from simulator.simulation import Simulator
+
+log = util.setup_logger(__name__)
+
+
+def _hashable(value):
+    """
+    Converts subreddit lists (or dict keys) into tuples so that they can be used in cache keys.
+    """
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return tuple(value)
+
+
+class SharedLookups(object):
+    """
+    Wraps a DatabaseConnection and caches the lookups of the current clock time.
+    The cache is cleared whenever the clock moves on. Returned values are shared and must not be modified.
+    """
+
+    CACHED = ["get_interpolated_price_data", "get_first_last_price_in_interval",
+              "get_first_last_data_in_interval", "get_all_price_data_in_interval"]
+
+    def __init__(self, db):
+        self.db = db
+        self.time = None
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def set_time(self, time):
+        if time != self.time:
+            self.time = time
+            self.cache = {}
+
+    def _cached(self, name, *args, **kwargs):
+        key = (name, tuple(_hashable(a) for a in args),
+               tuple(sorted((k, _hashable(v)) for k, v in kwargs.items())))
+        if key in self.cache:
+            self.hits += 1
+        else:
+            self.cache[key] = getattr(self.db, name)(*args, **kwargs)
+            self.misses += 1
+        return self.cache[key]
+
+    def __getattr__(self, name):
+        if name in SharedLookups.CACHED:
+            return lambda *args, **kwargs: self._cached(name, *args, **kwargs)
+        return getattr(self.db, name)
+
+
+class Clock(object):
+    """
+    Runs any number of simulators in a single pass ordered by their next wake time.
+    """
+
+    def __init__(self, db):
+        self.db = SharedLookups(db)
+        self.simulators = []
+
+    def add(self, policy, start_time, end_time, params=None, market=None, start_funds=100., verbose=False):
+        """
+        Adds a trader with its own (binance if not given) market and returns its Simulator.
+        A given market has to use the clock's db (Clock.db).
+        """
+        if market is None:
+            market = Market.create_binance_market(self.db)
+        market.verbose = verbose
+        trader = Trader(self.db, start_funds, market, params=params)
+        trader.policy = policy
+        sim = Simulator(trader, start_time, end_time=end_time, market=market, verbose=verbose)
+        market.setSimulator(sim)
+        market.setTrader(trader)
+        self.simulators.append(sim)
+        return sim
+
+    def run(self):
+        """
+        Runs all simulators until they are finished.
+        The results are the same as running every simulator on its own.
+        """
+        # (wake time, insertion order, simulator), the order keeps the heap from comparing simulators
+        heap = []
+        for i, sim in enumerate(self.simulators):
+            sim.start()
+            heapq.heappush(heap, (sim.time, i, sim))
+        while heap:
+            time, i, sim = heapq.heappop(heap)
+            self.db.set_time(time)
+            if sim.finished():
+                sim.finish()
+                continue
+            sim.simulation_step()
+            heapq.heappush(heap, (sim.time, i, sim))
+        log.info("Clock finished {} simulators, {} of {} lookups shared.".format(
+            len(self.simulators), self.db.hits, self.db.hits + self.db.misses))
+        return self.simulators
@@ -0,0 +1,221 @@
+"""
+Walk-forward and block bootstrap evaluation of the rebalancing policies.
+
+The data of the whole evaluation period is loaded once (see backtest.MarketData) and shared with
+forked worker processes. Every worker backtests all parameter combinations on a chunk of windows,
+the return distribution of every combination is reported. Policies the backtest does not implement
+(like the stagnation detection policies) are simulated window by window with simulator.run_policy.
+
+Usage: python -m simulator.evaluation --start "2018-01-01 00:00:00" --end "2018-03-01 00:00:00" \
+           --mode bootstrap --samples 500 --grid k=2,4 growth_hours=12,24
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import datetime
+import json
+import multiprocessing
+
+import numpy as np
+
+import util
+from simulator import backtest, policies, run_policy
+from simulator.market import Market
+from simulator.sweep import TIME_FORMAT, parse_grid
+from simulator.sweep import parameter_grid as simulated_parameter_grid
+from snapshot import connect
+
+log = util.setup_logger(__name__)
+
+PERCENTILES = [5, 25, 50, 75, 95]
+
+# simulated with simulator.run_policy, all --grid values are passed as trader params
+SIMULATED_POLICIES = ["subreddit_growth_policy_with_stagnation_detection",
+                      "subreddit_growth_policy_with_dynamic_stagnation_detection"]
+# the --grid values used by the backtest policies (see backtest.parameter_grid)
+BACKTEST_PARAMS = ["k", "step_hours", "growth_hours", "scale_spendings", "use_smoothing"]
+
+# shared with the forked workers
+_market_data = None
+_snapshot = None
+_db = None
+
+
+def walk_forward_windows(start, end, window_days, step_hours):
+    """
+    Returns (start, end) windows of window_days days which start every step_hours hours.
+    """
+    window = datetime.timedelta(days=window_days)
+    step = datetime.timedelta(hours=step_hours)
+    windows = []
+    s = start
+    while s + window <= end:
+        windows.append((s, s + window))
+        s += step
+    return windows
+
+
+def bootstrap_windows(start, end, window_days, samples, block_hours=24, resolution_minutes=60, random_state=None):
+    """
+    Returns samples windows whose start times are drawn with a moving block bootstrap:
+    blocks of consecutive start times (block_hours long, resolution_minutes apart) are drawn with replacement.
+    """
+    rng = np.random.RandomState(random_state)
+    window = datetime.timedelta(days=window_days)
+    resolution = datetime.timedelta(minutes=resolution_minutes)
+    n = int((end - window - start) // resolution) + 1
+    if n <= 0:
+        return []
+    block = max(1, min(n, int(block_hours * 60 // resolution_minutes)))
+    idx = []
+    while len(idx) < samples:
+        first = rng.randint(0, n - block + 1)
+        idx.extend(range(first, first + block))
+    return [(start + i * resolution, start + i * resolution + window) for i in sorted(idx[:samples])]
+
+
+def parameter_grid(policy_names, grid):
+    """
+    Returns a parameter dict (with the policy) for every policy and combination of the values in grid.
+    """
+    backtested = [p for p in policy_names if p in backtest.POLICIES]
+    combos = []
+    if backtested:
+        combos += backtest.parameter_grid(policies=backtested,
+                                          **{k: v for k, v in grid.items() if k in BACKTEST_PARAMS})
+    for policy_name in policy_names:
+        if policy_name not in backtest.POLICIES:
+            combos += [dict(params, policy=policy_name) for params in simulated_parameter_grid(grid)]
+    return combos
+
+
+def _simulate(combo, start, end):
+    """
+    Worker: simulates a policy the backtest does not implement (see sweep.run_cell),
+    returns the networth history or None if the simulation failed.
+    """
+    global _db
+    if _db is None:
+        _db = connect(_snapshot)
+    params = {k: v for k, v in combo.items() if k != "policy"}
+    try:
+        return run_policy(_db, getattr(policies, combo["policy"]), start, end, params=params).networth_history
+    except Exception as e:
+        log.warning("{} {} from {} to {} failed: {}".format(combo["policy"], params, start, end, e))
+        return None
+
+
+def _evaluate_chunk(args):
+    """
+    Worker: returns the returns (windows x combos) of a chunk of windows.
+    """
+    windows, combos = args
+    backtested = [j for j, c in enumerate(combos) if c["policy"] in backtest.POLICIES]
+    simulated = [j for j, c in enumerate(combos) if c["policy"] not in backtest.POLICIES]
+    returns = np.full((len(windows), len(combos)), np.nan)
+    for i, (start, end) in enumerate(windows):
+        histories = {}
+        if backtested:
+            results = backtest.backtest(_market_data, [combos[j] for j in backtested], start, end)
+            histories.update((j, r["networth_history"]) for j, r in zip(backtested, results) if not r["failed"])
+        for j in simulated:
+            histories[j] = _simulate(combos[j], start, end)
+        for j, history in histories.items():
+            if history is not None:
+                returns[i, j] = (history[-1] - history[0]) / history[0] * 100
+    return returns
+
+
+def evaluate(market_data, combos, windows, workers=None, chunk_size=8, snapshot=None):
+    """
+    Backtests all combos on all windows. Returns an array of returns in % (windows x combos),
+    nan where the simulation failed.
+    The policies which are not backtested are simulated on the snapshot (the database if None).
+    """
+    global _market_data, _snapshot
+    _market_data = market_data
+    _snapshot = snapshot
+    chunks = [(windows[i:i + chunk_size], combos) for i in range(0, len(windows), chunk_size)]
+    pool = multiprocessing.get_context("fork").Pool(workers)
+    try:
+        results = pool.map(_evaluate_chunk, chunks)
+    finally:
+        pool.close()
+        pool.join()
+    log.info("Evaluated {} combinations on {} windows.".format(len(combos), len(windows)))
+    return np.vstack(results) if results else np.empty((0, len(combos)))
+
+
+def distribution(returns):
+    """
+    Summary of the return distribution of every combination (columns of returns).
+    """
+    rows = []
+    for column in returns.T:
+        valid = column[~np.isnan(column)]
+        if len(valid) == 0:
+            rows.append(dict(runs=0, failed=len(column)))
+            continue
+        row = dict(runs=len(valid), failed=len(column) - len(valid), mean=valid.mean(), std=valid.std(),
+                   positive=np.mean(valid > 0))
+        for p, v in zip(PERCENTILES, np.percentile(valid, PERCENTILES)):
+            row["p{}".format(p)] = v
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Walk-forward and bootstrap evaluation of the policies")
+    parser.add_argument("--start", required=True, help="UTC, '{}'".format(TIME_FORMAT))
+    parser.add_argument("--end", required=True, help="UTC, '{}'".format(TIME_FORMAT))
+    parser.add_argument("--mode", default="walk_forward", choices=["walk_forward", "bootstrap"])
+    parser.add_argument("--window_days", type=float, default=15)
+    parser.add_argument("--step_hours", type=float, default=6,
+                        help="Distance of the walk-forward windows.")
+    parser.add_argument("--samples", type=int, default=500, help="Number of bootstrap windows.")
+    parser.add_argument("--block_hours", type=float, default=24)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--policies", nargs="+", default=backtest.POLICIES,
+                        choices=backtest.POLICIES + SIMULATED_POLICIES)
+    parser.add_argument("--grid", nargs="*", default=[], metavar="NAME=V1,V2",
+                        help="Parameter values (see backtest.parameter_grid and simulator.policies.get_params), "
+                             "e.g. k=2,4,6.")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--snapshot", default=None, help="Snapshot directory used instead of the database.")
+    parser.add_argument("--output", default="evaluation.csv")
+    args = parser.parse_args()
+
+    start = datetime.datetime.strptime(args.start, TIME_FORMAT)
+    end = datetime.datetime.strptime(args.end, TIME_FORMAT)
+    if args.mode == "walk_forward":
+        windows = walk_forward_windows(start, end, args.window_days, args.step_hours)
+    else:
+        windows = bootstrap_windows(start, end, args.window_days, args.samples, block_hours=args.block_hours,
+                                    random_state=args.seed)
+    combos = parameter_grid(args.policies, parse_grid(args.grid))
+    backtested = [c for c in combos if c["policy"] in backtest.POLICIES]
+
+    market_data = None
+    if backtested:
+        db = connect(args.snapshot)
+        try:
+            market_data = backtest.MarketData.load(db, Market.create_binance_market(db), start, end,
+                                                   max(c["growth_hours"] for c in backtested),
+                                                   max(c["step_hours"] for c in backtested))
+        finally:
+            db.close()
+    rows = distribution(evaluate(market_data, combos, windows, workers=args.workers, snapshot=args.snapshot))
+
+    columns = ["runs", "failed", "mean", "std", "positive"] + ["p{}".format(p) for p in PERCENTILES]
+    table = [("policy", "params") + tuple(columns)]
+    for combo, row in zip(combos, rows):
+        params = {k: v for k, v in combo.items() if k != "policy"}
+        table.append((combo["policy"], json.dumps(params, sort_keys=True).replace(",", ";")) +
+                     tuple(row.get(c, np.nan) for c in columns))
+    util.export_to_csv(args.output, table)
+    for line in sorted(table[1:], key=lambda r: -r[4] if r[2] else np.inf):
+        print("{:25} {:110} {:5} {:5} {:8.2f} {:8.2f} {:6.2f}".format(*line[:7]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,16 @@
 import datetime
 
-import database
+import numpy as np
+
 import settings
 import util
+from panel import from_us, to_us
 
 log = util.setup_logger(__name__)
 
+BUY = 1
+SELL = -1
+
 class InsufficientFundsException(Exception):
 
     def __init__(self, coin_name):
@@ -16,13 +21,15 @@ class Trader(object):
     Generic class which can be extended to implement traders.
     """
 
-    def __init__(self, db, start_funds, market):
+    def __init__(self, db, start_funds, market, params=None):
         """
         Constructor for star funds in USD and a market object.
+        params overwrites the default policy parameters (see simulator.policies.get_params).
         """
         self.funds = start_funds
         self.market = market
         self.db = db
+        self.params = params or {}
 
     def policy(self, time, step_nr):
         """
@@ -31,6 +38,104 @@ class Trader(object):
         """
         return datetime.timedelta(hours=1)
 
+class Ledger(object):
+    """
+    Append-only record of all trades of a market stored in a growing structured array.
+    """
+
+    DTYPE = np.dtype([("time", "<i8"), ("coin", "<i4"), ("side", "i1"),
+                      ("qty", "<f8"), ("price", "<f8"), ("fee", "<f8")])
+
+    def __init__(self, coins, capacity=256):
+        self.coins = list(coins)
+        self.coin_index = {c: i for i, c in enumerate(self.coins)}
+        self._data = np.zeros(capacity, dtype=Ledger.DTYPE)
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    def append(self, time, coin, side, qty, price, fee):
+        """
+        Records a trade of qty coins (a subreddit name) at time, side is BUY or SELL.
+        """
+        if self._n == len(self._data):
+            self._data = np.concatenate([self._data, np.zeros(len(self._data), dtype=Ledger.DTYPE)])
+        self._data[self._n] = (to_us(time), self.coin_index[coin], side, qty, price, fee)
+        self._n += 1
+
+    def records(self):
+        """
+        Returns all trades as a structured array (time in us, coin index, side, qty, price, fee).
+        """
+        return self._data[:self._n]
+
+    def columns(self):
+        return {name: self._data[name][:self._n] for name in Ledger.DTYPE.names}
+
+    def save(self, path):
+        """
+        Writes the trade columns and the coin names to an .npz file.
+        """
+        np.savez_compressed(path, coins=np.array(self.coins), **self.columns())
+
+    def export_csv(self, path):
+        rows = [("time", "coin", "side", "qty", "price", "fee")]
+        for r in self.records():
+            rows.append((from_us(r["time"]), self.coins[r["coin"]], "buy" if r["side"] == BUY else "sell",
+                         r["qty"], r["price"], r["fee"]))
+        util.export_to_csv(path, rows)
+
+def portfolio_value(prices, balances):
+    """
+    Value of the held coins (prices and balances in portfolio order).
+    The backtester uses the same function so that its results are identical to the simulator.
+    """
+    return float(np.dot(prices, balances))
+
+class Portfolio(object):
+    """
+    Coin balances stored in a numpy vector with a dict-like interface (coin -> balance).
+    """
+
+    def __init__(self, coins):
+        # duplicate coins are merged like in a dict
+        self.coins = list(dict.fromkeys(coins))
+        self.coin_index = {c: i for i, c in enumerate(self.coins)}
+        self.balances = np.zeros(len(self.coins))
+        # last known price of every coin
+        self.prices = np.full(len(self.coins), np.nan)
+
+    def __getitem__(self, coin):
+        return float(self.balances[self.coin_index[coin]])
+
+    def __setitem__(self, coin, balance):
+        self.balances[self.coin_index[coin]] = balance
+
+    def __contains__(self, coin):
+        return coin in self.coin_index
+
+    def __iter__(self):
+        return iter(self.coins)
+
+    def __len__(self):
+        return len(self.coins)
+
+    def keys(self):
+        return list(self.coins)
+
+    def values(self):
+        return [float(b) for b in self.balances]
+
+    def items(self):
+        return list(zip(self.coins, self.values()))
+
+    def held(self):
+        """
+        Indices of the coins with a positive balance (in portfolio order).
+        """
+        return np.flatnonzero(self.balances > 0)
+
 class Market(object):
     """
     A class which can simulate the interaction with a market for a trader.
@@ -40,14 +145,15 @@ class Market(object):
         if coins is None:
             coins = util.read_csv(settings.general["subreddit_file"])
         self.fees = fees
-        self.portfolio = {}
-        for coin in coins:
-            self.portfolio[coin[-1]] = 0.0
+        self.portfolio = Portfolio([coin[-1] for coin in coins])
         self.db = db
         self.simulator = simulator
         self.verbose = verbose
-        self.transaction_log = {}
+        self.ledger = Ledger(self.portfolio.coins)
         self.trader = trader
+        # traded dollars (buys and sells) and paid fees
+        self.volume = 0.0
+        self.fees_paid = 0.0
 
     def setSimulator(self, sim):
         self.simulator = sim
@@ -66,8 +172,11 @@ class Market(object):
         self.trader.funds -= total
         bought_coins = total * (1-self.fees) / current_price
         self.portfolio[coin] += bought_coins
+        self.volume += total
+        self.fees_paid += total * self.fees
+        self.ledger.append(self.simulator.time, coin, BUY, bought_coins, current_price, total * self.fees)
         if self.verbose:
-            log.info("Bought {:8.4f} {} for {:5.2f}.".format(bought_coins, coin, total))
+            log.info("Bought %8.4f %s for %5.2f.", bought_coins, coin, total)
 
     def sell(self, coin, total=None):
         """
@@ -82,17 +191,19 @@ class Market(object):
         dollars = (1-self.fees) * total * current_value
         self.trader.funds += dollars
         self.portfolio[coin] -= total
+        self.volume += total * current_value
+        self.fees_paid += self.fees * total * current_value
+        self.ledger.append(self.simulator.time, coin, SELL, total, current_value, self.fees * total * current_value)
         if self.verbose:
-            log.info("Sold {:8.4f} {} for ${:5.2f}.".format(total, coin, dollars))
+            log.info("Sold %8.4f %s for $%5.2f.", total, coin, dollars)
 
     def owned_coins(self):
         """
         Returns a dict with the owned coins and current balance if the current balance is > 0.
         """
         ret_dict = {}
-        for k, d in self.portfolio.items():
-            if d > 0:
-                ret_dict[k] = d
+        for i in self.portfolio.held():
+            ret_dict[self.portfolio.coins[i]] = float(self.portfolio.balances[i])
         return ret_dict
 
     def current_balance(self, coin):
@@ -102,32 +213,29 @@ class Market(object):
         """
         Will sell all coins the trader owns.
         """
-        for coin, balance in self.portfolio.items():
-            if balance > 0:
-                self.sell(coin)
+        for i in self.portfolio.held():
+            self.sell(self.portfolio.coins[i])
 
     def portfolio_value(self):
         """
         Returns the current total value of the portfolio.
         """
-        total_value = 0.0
-        for coin, balance in self.portfolio.items():
-            if balance > 0:
-                current_value = self.db.get_interpolated_price_data(coin, self.simulator.time)[0]
-                total_value += current_value * balance
-        return total_value
+        held = self.portfolio.held()
+        for i in held:
+            self.portfolio.prices[i] = self.db.get_interpolated_price_data(self.portfolio.coins[i], self.simulator.time)[0]
+        return portfolio_value(self.portfolio.prices[held], self.portfolio.balances[held])
 
-    def create_binance_market(db):
+    def create_binance_market(db, verbose=True):
         coins = util.read_csv(settings.general["binance_file"])
         fee = 0.001
-        return Market(db, fees=fee, coins=coins)
+        return Market(db, fees=fee, coins=coins, verbose=verbose)
 
-    def create_poloniex_market(db):
+    def create_poloniex_market(db, verbose=True):
         coins = util.read_csv(settings.general["poloniex_file"])
         fee = 0.0025
-        return Market(db, fees=fee, coins=coins)
+        return Market(db, fees=fee, coins=coins, verbose=verbose)
 
-    def create_bittrex_market(db):
+    def create_bittrex_market(db, verbose=True):
         coins = util.read_csv(settings.general["bittrex_file"])
         fee = 0.0025
-        return Market(db, fees=fee, coins=coins)
+        return Market(db, fees=fee, coins=coins, verbose=verbose)
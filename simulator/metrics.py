@@ -0,0 +1,180 @@
+"""
+Performance metrics of simulation results.
+
+The batch functions take a networth history (1d) or many histories (runs x steps, padded with nan)
+and compute along the last axis. RunningMetrics computes the same metrics while a simulation runs.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+SECONDS_PER_YEAR = 365 * 24 * 3600.
+
+
+def pad(histories):
+    """
+    Stacks histories of different lengths into an array (runs x steps) padded with nan.
+    """
+    result = np.full((len(histories), max(len(h) for h in histories)), np.nan)
+    for i, h in enumerate(histories):
+        result[i, :len(h)] = h
+    return result
+
+
+def periods_per_year(date_history):
+    """
+    Number of simulation steps per year (from the mean step length).
+    """
+    seconds = (date_history[-1] - date_history[0]).total_seconds()
+    return (len(date_history) - 1) * SECONDS_PER_YEAR / seconds
+
+
+def returns(networth):
+    """
+    Relative change of every step.
+    """
+    networth = np.asarray(networth, dtype=float)
+    return np.diff(networth, axis=-1) / networth[..., :-1]
+
+
+def _last(networth):
+    # last value of every run (runs are padded with nan)
+    valid = ~np.isnan(networth)
+    idx = valid.shape[-1] - 1 - np.argmax(valid[..., ::-1], axis=-1)
+    return np.take_along_axis(networth, idx[..., None], axis=-1)[..., 0]
+
+
+def cumulative_return(networth):
+    networth = np.asarray(networth, dtype=float)
+    return _last(networth) / networth[..., 0] - 1
+
+
+def annualized_volatility(networth, periods):
+    return np.nanstd(returns(networth), axis=-1, ddof=1) * np.sqrt(periods)
+
+
+def sharpe_ratio(networth, periods):
+    """
+    Annualized sharpe ratio (with a risk free rate of 0).
+    """
+    r = returns(networth)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.nanmean(r, axis=-1) / np.nanstd(r, axis=-1, ddof=1) * np.sqrt(periods)
+
+
+def sortino_ratio(networth, periods):
+    """
+    Annualized sortino ratio (mean return over the downside deviation).
+    """
+    r = returns(networth)
+    downside = np.sqrt(np.nanmean(np.minimum(r, 0) ** 2, axis=-1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.nanmean(r, axis=-1) / downside * np.sqrt(periods)
+
+
+def max_drawdown(networth):
+    """
+    Largest relative loss from a previous peak.
+    """
+    networth = np.asarray(networth, dtype=float)
+    peak = np.fmax.accumulate(networth, axis=-1)
+    return np.nanmax(1 - networth / peak, axis=-1)
+
+
+def turnover(volume, networth):
+    """
+    Traded volume relative to the mean networth.
+    """
+    return np.asarray(volume) / np.nanmean(networth, axis=-1)
+
+
+def fee_drag(fees_paid, networth):
+    """
+    Fees paid relative to the start networth, i.e. the part of the return lost to fees.
+    """
+    return np.asarray(fees_paid) / np.asarray(networth, dtype=float)[..., 0]
+
+
+def summary(networth_history, date_history, volume=None, fees_paid=None):
+    """
+    Returns a dict with all metrics of one run or of many runs.
+    For many runs date_history is either shared or a list with the date history of every run.
+    """
+    if len(date_history) and isinstance(date_history[0], (list, tuple)):
+        periods = np.array([periods_per_year(d) for d in date_history])
+    else:
+        periods = periods_per_year(date_history)
+    result = dict(cumulative_return=cumulative_return(networth_history),
+                  annualized_volatility=annualized_volatility(networth_history, periods),
+                  sharpe_ratio=sharpe_ratio(networth_history, periods),
+                  sortino_ratio=sortino_ratio(networth_history, periods),
+                  max_drawdown=max_drawdown(networth_history))
+    if volume is not None:
+        result["turnover"] = turnover(volume, networth_history)
+    if fees_paid is not None:
+        result["fee_drag"] = fee_drag(fees_paid, networth_history)
+    return result
+
+
+class RunningMetrics(object):
+    """
+    Computes the metrics of a run one networth value at a time.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.first = None
+        self.last = None
+        self.first_time = None
+        self.last_time = None
+        self.peak = None
+        self.max_drawdown = 0.
+        self.networth_sum = 0.
+        # Welford's algorithm for the returns
+        self.mean = 0.
+        self.m2 = 0.
+        self.downside = 0.
+        self.returns = 0
+
+    def update(self, networth, time):
+        if self.n == 0:
+            self.first = networth
+            self.first_time = time
+            self.peak = networth
+        else:
+            r = (networth - self.last) / self.last
+            self.returns += 1
+            delta = r - self.mean
+            self.mean += delta / self.returns
+            self.m2 += delta * (r - self.mean)
+            self.downside += min(r, 0.) ** 2
+        self.n += 1
+        self.last = networth
+        self.last_time = time
+        self.networth_sum += networth
+        self.peak = max(self.peak, networth)
+        self.max_drawdown = max(self.max_drawdown, 1 - networth / self.peak)
+
+    def metrics(self, volume=None, fees_paid=None):
+        """
+        Returns the metrics of the values seen so far (see summary).
+        """
+        result = dict(cumulative_return=np.nan, annualized_volatility=np.nan, sharpe_ratio=np.nan,
+                      sortino_ratio=np.nan, max_drawdown=self.max_drawdown)
+        if self.n == 0:
+            return result
+        result["cumulative_return"] = self.last / self.first - 1
+        seconds = (self.last_time - self.first_time).total_seconds()
+        if self.returns > 1 and seconds > 0:
+            periods = self.returns * SECONDS_PER_YEAR / seconds
+            std = np.sqrt(self.m2 / (self.returns - 1))
+            downside = np.sqrt(self.downside / self.returns)
+            result["annualized_volatility"] = std * np.sqrt(periods)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                result["sharpe_ratio"] = np.float64(self.mean) / std * np.sqrt(periods)
+                result["sortino_ratio"] = np.float64(self.mean) / downside * np.sqrt(periods)
+        if volume is not None:
+            result["turnover"] = volume / (self.networth_sum / self.n)
+        if fees_paid is not None:
+            result["fee_drag"] = fees_paid / self.first
+        return result
@@ -0,0 +1,57 @@
+"""
+Headless output of simulation runs.
+
+Every run is written to a compressed .npz file with the equity curve and all trades as columns,
+plotting is done separately (see simulator.plot) so that batch runs never import matplotlib.
+"""
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+
+import numpy as np
+
+import util
+from panel import from_us, to_us
+
+log = util.setup_logger(__name__)
+
+
+def save_run(path, sim, name=None):
+    """
+    Writes the equity curve and the trades of a finished Simulator to path (.npz).
+    """
+    market = sim.market
+    trades = market.ledger.columns()
+    meta = dict(name=name, start_time=str(sim.start_time), end_time=str(sim.end_time), fees=market.fees,
+                params=getattr(sim.trader, "params", None) or {},
+                metrics={k: float(v) for k, v in sim.metrics.metrics(market.volume, market.fees_paid).items()})
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    np.savez_compressed(path,
+                        meta=np.array(json.dumps(meta)),
+                        coins=np.array(market.ledger.coins),
+                        dates=np.array([to_us(d) for d in sim.date_history], dtype=np.int64),
+                        networth=np.array(sim.networth_history, dtype=float),
+                        **{"trade_" + key: column for key, column in trades.items()})
+    log.info("Wrote run {} to {}.".format(name, path))
+    return path
+
+
+def load_run(path):
+    """
+    Reads a run written by save_run. Returns a dict with the meta data, the date_history (datetimes),
+    the networth_history and the trade columns.
+    """
+    with np.load(path) as f:
+        run = json.loads(str(f["meta"]))
+        run["coins"] = [str(c) for c in f["coins"]]
+        run["date_history"] = [from_us(d) for d in f["dates"]]
+        run["networth_history"] = f["networth"]
+        run["trades"] = {k[len("trade_"):]: f[k] for k in f.files if k.startswith("trade_")}
+    return run
+
+
+def run_path(directory, name, start_time):
+    return os.path.join(directory, "{}_{}.npz".format(name, start_time.strftime("%Y%m%d_%H%M%S")))
@@ -0,0 +1,53 @@
+"""
+Optional matplotlib renderer for runs written by simulator.output.
+
+Usage: python -m simulator.plot runs/*.npz [--output plot.png]
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+
+import matplotlib.pyplot as plt
+
+from simulator.output import load_run
+
+COLORS = {
+    "subreddit_growth_policy": "b",
+    "subreddit_growth_policy_with_stagnation_detection": "r",
+    "hybrid_policy": "g",
+    "largest_xhr_policy": "orange",
+    "subreddit_growth_policy_with_dynamic_stagnation_detection": "yellow"
+}
+
+
+def render(paths, title=None, output=None):
+    """
+    Plots the equity curves of the runs in paths. Shows the plot if no output file is given.
+    """
+    handles = {}
+    for path in paths:
+        run = load_run(path)
+        plot, = plt.plot_date(run["date_history"], run["networth_history"], "-", label=run["name"],
+                              color=COLORS.get(run["name"]))
+        # one legend entry per policy
+        handles[run["name"]] = plot
+    plt.legend(handles=list(handles.values()))
+    if title is not None:
+        plt.title(title)
+    if output is None:
+        plt.show()
+    else:
+        plt.savefig(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plot simulation runs")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--title", default=None)
+    parser.add_argument("--output", default=None, help="Image file (default: show the plot).")
+    args = parser.parse_args()
+    render(args.paths, title=args.title, output=args.output)
+
+
+if __name__ == "__main__":
+    main()
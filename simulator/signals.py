@@ -0,0 +1,75 @@
+"""
+Memoized ranking signals for the simulator policies.
+
+The rankings of query.average_growth and query.percentage_price_growths are cached by
+(signal name, coins, window) with LRU eviction, so policies (and simulations with different offsets)
+which ask for the same window share the result. The cache assumes that all simulations of a process
+read the same data, call clear() before switching to another data source (simulate clears it per call).
+"""
+import collections
+
+import query
+import util
+from settings import simulator as simulator_settings
+
+log = util.setup_logger(__name__)
+
+
+class SignalCache(object):
+    """
+    LRU cache of rankings ([subreddit, value] lists). Callers get copies which they may modify.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        if key in self.data:
+            self.data.move_to_end(key)
+            self.hits += 1
+        else:
+            self.data[key] = compute()
+            self.misses += 1
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+        return [list(row) for row in self.data[key]]
+
+    def clear(self):
+        self.data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses, size=len(self.data),
+                    hit_rate=self.hits / float(requests) if requests else 0.)
+
+
+cache = SignalCache(simulator_settings["signal_cache_size"])
+
+
+def average_growth(db, subreddits, start_time, end_time):
+    """
+    Cached query.average_growth (sorted by growth).
+    """
+    subreddits = tuple(subreddits)
+    return cache.get(("average_growth", subreddits, start_time, end_time),
+                     lambda: query.average_growth(db, subreddits, start_time, end_time))
+
+
+def percentage_price_growths(db, subreddits, start, end):
+    """
+    Cached query.percentage_price_growths (sorted by growth).
+    """
+    subreddits = tuple(subreddits)
+    return cache.get(("percentage_price_growths", subreddits, start, end),
+                     lambda: query.percentage_price_growths(db, subreddits, start, end))
+
+
+def log_stats():
+    s = cache.stats()
+    log.info("Signal cache: {} hits, {} misses ({:.1%} hit rate), {} entries.".format(
+        s["hits"], s["misses"], s["hit_rate"], s["size"]))
@@ -0,0 +1,82 @@
+"""
+The Simulator steps a trader through time, records its networth and checkpoints its state.
+"""
+import datetime
+
+import util
+from settings import simulator as simulator_settings
+from simulator.checkpoint import load_checkpoint, restore, save_checkpoint
+from simulator.market import Market
+from simulator.metrics import RunningMetrics
+
+log = util.setup_logger(__name__)
+
+class Simulator(object):
+
+    def __init__(self, trader, start_time, end_time = datetime.datetime.utcnow(),
+               market=None, verbose=True, checkpoint_path=None, checkpoint_steps=None):
+        if market is None:
+            self.market = Market()
+        else:
+            self.market = market
+        self.trader = trader
+        self.start_time = start_time
+        self.end_time = end_time
+        self.time = start_time
+        self.verbose = verbose
+        self.networth_history = []
+        self.date_history = []
+        self.metrics = RunningMetrics()
+        # the state is saved every checkpoint_steps steps if a checkpoint_path is given
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_steps = checkpoint_steps or simulator_settings["checkpoint_steps"]
+
+    def record(self, networth):
+        self.networth_history.append(networth)
+        self.date_history.append(self.time)
+        self.metrics.update(networth, self.time)
+
+    def simulation_step(self):
+        port_val = self.market.portfolio_value()
+        self.record(self.trader.funds + port_val)
+        if self.verbose:
+            log.info("------Time: {}".format(self.time))
+            log.info("Coin value: {:8.2f}".format(port_val))
+            log.info("funds: {:13.2f}".format(self.trader.funds))
+            log.info("Sum: {:15.2f}".format(self.trader.funds + port_val))
+        self.time += self.trader.policy(self.trader, self.time, self.steps)
+        self.steps += 1
+
+    def start(self):
+        log.info("Running simulator...")
+        self.steps = 0
+
+    def finished(self):
+        return self.time >= self.end_time
+
+    def run(self):
+        self.start()
+        self.run_steps()
+
+    def resume(self, path):
+        """
+        Continues a simulation from a checkpoint (see simulator.checkpoint).
+        """
+        restore(self, load_checkpoint(path))
+        log.info("Resuming simulator at step {} ({})...".format(self.steps, self.time))
+        self.run_steps()
+
+    def run_steps(self):
+        while not self.finished():
+            self.simulation_step()
+            if self.checkpoint_path is not None and self.steps % self.checkpoint_steps == 0:
+                save_checkpoint(self.checkpoint_path, self)
+        self.finish()
+
+    def finish(self):
+        self.market.sell_all()
+        self.record(self.trader.funds)
+        log.info("Simulation finished:")
+        log.info("Ran {} steps from {} to {}.".format(self.steps, self.start_time, self.time))
+        log.info("Trader finished with {:8.2f}.".format(self.trader.funds))
+        log.info("Metrics: {}".format(self.metrics.metrics(self.market.volume, self.market.fees_paid)))
@@ -0,0 +1,209 @@
+"""
+Parameter sweeps of the simulator policies.
+
+Every cell of the sweep is one simulation of a policy with one parameter combination and one start offset.
+The cells are run in worker processes (each with its own database connection, or the snapshot given with
+--snapshot, see snapshot.export) and every finished cell is appended to a results file (json lines),
+so an interrupted sweep continues where it stopped.
+
+Usage: python -m simulator.sweep --policies subreddit_growth_policy largest_xhr_policy \
+           --grid k=2,4,6 growth_hours=12,24 --offsets 60 103 146 --output sweep.jsonl
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import ast
+import concurrent.futures
+import datetime
+import itertools
+import json
+import os
+
+import numpy as np
+
+import util
+from simulator import policies, run_policy
+from snapshot import SnapshotConnection, connect
+
+log = util.setup_logger(__name__)
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_db = None
+
+
+def parameter_grid(grid):
+    """
+    Returns a parameter dict for every combination of the values in grid (a dict name -> list of values).
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[n] for n in names])]
+
+
+def cell_key(policy_name, params, offset):
+    return json.dumps([policy_name, params, offset], sort_keys=True)
+
+
+def run_cell(policy_name, params, offset, end_time, days, snapshot=None):
+    """
+    Worker: simulates one cell and returns its result dict.
+    The simulation ends offset minutes before end_time and lasts days days.
+    """
+    global _db
+    if _db is None:
+        _db = connect(snapshot)
+    end = end_time - datetime.timedelta(minutes=offset)
+    start = end - datetime.timedelta(days)
+    result = dict(policy=policy_name, params=params, offset=offset)
+    try:
+        sim = run_policy(_db, getattr(policies, policy_name), start, end, params=params)
+    except Exception as e:
+        log.warning("{} {} offset {} failed: {}".format(policy_name, params, offset, e))
+        result["error"] = str(e)
+        return result
+    result["networth"] = [float(n) for n in sim.networth_history]
+    result["return"] = (sim.networth_history[-1] - sim.networth_history[0]) / sim.networth_history[0] * 100
+    return result
+
+
+class Sweep(object):
+    """
+    A resumable sweep stored in path.
+    The first line of the file holds the end time and length of the simulations (and the snapshot),
+    every other line one cell.
+    """
+
+    def __init__(self, path, end_time=None, days=15, snapshot=None):
+        self.path = path
+        self.snapshot = snapshot
+        self.results = {}
+        header = None
+        if os.path.exists(path):
+            with open(path) as f:
+                lines = f.read().split("\n")
+            header = self._parse_header(lines[0])
+            if header is None:
+                log.warning("Sweep {} has no valid header, starting a new sweep.".format(path))
+        if header is None:
+            self._start(end_time, days, snapshot)
+            return
+        # the last line is incomplete if the sweep was killed while writing it
+        if lines[-1]:
+            with open(path, "w") as f:
+                f.write("\n".join(lines[:-1]) + "\n")
+        for line in lines[1:-1]:
+            r = json.loads(line)
+            self.results[cell_key(r["policy"], r["params"], r["offset"])] = r
+        stored_end = datetime.datetime.strptime(header["end_time"], TIME_FORMAT)
+        if (end_time is not None and end_time != stored_end) or days != header["days"] or \
+           snapshot != header.get("snapshot"):
+            raise ValueError("Sweep {} was started with end time {}, {} days and snapshot {}.".format(
+                path, header["end_time"], header["days"], header.get("snapshot")))
+        self.end_time = stored_end
+        self.days = header["days"]
+        log.info("Resuming sweep {} with {} finished cells.".format(path, len(self.results)))
+
+    @staticmethod
+    def _parse_header(line):
+        """
+        Returns the header dict or None if the line is empty or truncated.
+        """
+        try:
+            header = json.loads(line)
+            datetime.datetime.strptime(header["end_time"], TIME_FORMAT)
+            header["days"]
+        except (ValueError, TypeError, KeyError):
+            return None
+        return header
+
+    def _start(self, end_time, days, snapshot):
+        """
+        Writes the header of a new sweep (replacing the file).
+        """
+        if end_time is None and snapshot is not None:
+            end_time = SnapshotConnection(snapshot).end.replace(second=0, microsecond=0)
+        elif end_time is None:
+            end_time = datetime.datetime.utcnow().replace(second=0, microsecond=0)
+        self.end_time = end_time
+        self.days = days
+        with open(self.path, "w") as f:
+            f.write(json.dumps(dict(end_time=end_time.strftime(TIME_FORMAT), days=days,
+                                    snapshot=snapshot)) + "\n")
+
+    def run(self, policy_names, grid, offsets, workers=None):
+        """
+        Runs all cells which are not in the results file yet.
+        """
+        cells = [(p, params, offset) for p in policy_names for params in parameter_grid(grid) for offset in offsets]
+        todo = [c for c in cells if cell_key(*c) not in self.results]
+        log.info("Sweep: {} cells, {} to run.".format(len(cells), len(todo)))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_cell, p, params, offset, self.end_time, self.days, self.snapshot)
+                       for p, params, offset in todo]
+            for i, future in enumerate(concurrent.futures.as_completed(futures)):
+                r = future.result()
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(r) + "\n")
+                self.results[cell_key(r["policy"], r["params"], r["offset"])] = r
+                log.info("Finished cell {} of {}.".format(i + 1, len(todo)))
+
+    def summary(self):
+        """
+        Returns one row (policy, params, runs, errors, mean, std, min, max return in %) per policy and
+        parameter combination sorted by mean return.
+        """
+        groups = {}
+        for r in self.results.values():
+            groups.setdefault(json.dumps([r["policy"], r["params"]], sort_keys=True), []).append(r)
+        rows = []
+        for key, results in groups.items():
+            policy_name, params = json.loads(key)
+            returns = np.array([r["return"] for r in results if "error" not in r])
+            errors = len(results) - len(returns)
+            if len(returns) == 0:
+                rows.append((policy_name, params, 0, errors, np.nan, np.nan, np.nan, np.nan))
+                continue
+            rows.append((policy_name, params, len(returns), errors, returns.mean(), returns.std(),
+                         returns.min(), returns.max()))
+        return sorted(rows, key=lambda r: -r[4] if r[2] else np.inf)
+
+
+def parse_grid(items):
+    """
+    Parses name=value1,value2,... arguments into a grid dict.
+    """
+    grid = {}
+    for item in items:
+        name, values = item.split("=", 1)
+        grid[name] = [ast.literal_eval(v) for v in values.split(",")]
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Policy parameter sweep")
+    parser.add_argument("--policies", nargs="+", default=["subreddit_growth_policy", "largest_xhr_policy"])
+    parser.add_argument("--grid", nargs="*", default=[], metavar="NAME=V1,V2",
+                        help="Parameter values (see simulator.policies.get_params), e.g. k=2,4,6.")
+    parser.add_argument("--offsets", nargs="+", type=int, default=list(range(60, 500, 43)),
+                        help="Minutes between the end of the simulations and the end time.")
+    parser.add_argument("--days", type=int, default=15)
+    parser.add_argument("--end_time", default=None, help="End time (UTC, '{}').".format(TIME_FORMAT))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--snapshot", default=None, help="Snapshot directory used instead of the database.")
+    parser.add_argument("--output", default="sweep.jsonl", help="Results file (an existing sweep is resumed).")
+    parser.add_argument("--summary", default="sweep_summary.csv")
+    args = parser.parse_args()
+
+    end_time = datetime.datetime.strptime(args.end_time, TIME_FORMAT) if args.end_time else None
+    sweep = Sweep(args.output, end_time=end_time, days=args.days, snapshot=args.snapshot)
+    sweep.run(args.policies, parse_grid(args.grid), args.offsets, workers=args.workers)
+    rows = sweep.summary()
+    util.export_to_csv(args.summary, [("policy", "params", "runs", "errors", "mean", "std", "min", "max")] +
+                       [(r[0], json.dumps(r[1], sort_keys=True).replace(",", ";")) + r[2:] for r in rows])
+    for r in rows:
+        print("{:60} {:40} {:4} {:4} {:8.2f} {:8.2f} {:8.2f} {:8.2f}".format(
+            r[0], json.dumps(r[1], sort_keys=True), *r[2:]))
+
+
+if __name__ == "__main__":
+    main()
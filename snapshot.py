@@ -0,0 +1,271 @@
+"""
+File snapshots of the data and price tables.
+
+export writes the rows of a time range to a directory of .npy files (times, values and per subreddit
+offsets of each table, see panel.Series) and a meta.json. SnapshotConnection memory maps such a directory
+and answers the read queries of database.DatabaseConnection in process, so backtests run without Postgres.
+Queries are only equal to the database within the exported range.
+"""
+from __future__ import absolute_import, division, print_function
+
+import datetime
+import json
+import os
+
+import numpy as np
+
+import util
+from panel import MICROSECOND, Series, from_us, to_us
+
+log = util.setup_logger(__name__)
+
+VERSION = 1
+TABLES = ("data", "price")
+ARRAYS = ("offsets", "times", "values")
+
+
+def export(db, path, start, end):
+    """
+    Writes all data and price rows in the interval (start, end) to the directory path.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    meta = dict(version=VERSION, start=to_us(start), end=to_us(end), tables={})
+    for table in TABLES:
+        if table == "data":
+            series = Series.load_data(db, None, start, end)
+        else:
+            series = Series.load_price(db, None, start, end)
+        for name in ARRAYS:
+            np.save(os.path.join(path, "{}_{}.npy".format(table, name)), getattr(series, name))
+        meta["tables"][table] = dict(coins=series.coins, columns=series.columns, rows=len(series))
+        log.info("Exported {} {} rows of {} subreddits.".format(len(series), table, len(series.coins)))
+    # meta.json is written last, a directory without it is incomplete
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return path
+
+
+def connect(snapshot=None):
+    """
+    Returns a SnapshotConnection for the snapshot directory or a DatabaseConnection if snapshot is None.
+    """
+    if snapshot is not None:
+        return SnapshotConnection(snapshot)
+    from database import DatabaseConnection
+    return DatabaseConnection(**util.get_postgres_auth())
+
+
+class SnapshotConnection(object):
+    """
+    Read-only DatabaseConnection backed by a snapshot directory (see export).
+    """
+
+    def __init__(self, path, mmap_mode="r"):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["version"] != VERSION:
+            raise ValueError("Unsupported snapshot version {} in {}.".format(meta["version"], path))
+        self.path = path
+        self.start = from_us(meta["start"])
+        self.end = from_us(meta["end"])
+        tables = {}
+        for table in TABLES:
+            arrays = [np.load(os.path.join(path, "{}_{}.npy".format(table, name)), mmap_mode=mmap_mode)
+                      for name in ARRAYS]
+            tables[table] = Series(meta["tables"][table]["coins"], *arrays,
+                                   columns=meta["tables"][table]["columns"])
+        self.data = tables["data"]
+        self.price = tables["price"]
+        self._coin_nr = {}
+        log.info("Opened snapshot {} ({} to {}).".format(path, self.start, self.end))
+
+    def close(self):
+        pass
+
+    # ------------ helpers ------------
+
+    def _coin_numbers(self, series):
+        """
+        Coin index of every row of series.
+        """
+        key = id(series)
+        if key not in self._coin_nr:
+            self._coin_nr[key] = np.repeat(np.arange(len(series.coins)), np.diff(series.offsets))
+        return self._coin_nr[key]
+
+    def _newest_first(self, series, start, end):
+        """
+        Indices of all rows in the interval (start, end) ordered by time (newest first).
+        """
+        idx = np.flatnonzero((series.times > to_us(start)) & (series.times < to_us(end)))
+        return idx[np.argsort(-series.times[idx], kind="stable")]
+
+    def _series_rows(self, series, subreddits, start, end):
+        """
+        (subreddit, time, values...) rows in the interval ordered by subreddit and time.
+        """
+        coins = series.coins if subreddits is None else [s for s in subreddits if s in series]
+        rows = []
+        for coin in sorted(set(coins)):
+            times, values = series.rows(coin)
+            lo = np.searchsorted(times, to_us(start), side="right")
+            hi = np.searchsorted(times, to_us(end), side="left")
+            rows.extend((coin, from_us(t)) + tuple(v) for t, v in zip(times[lo:hi], values[lo:hi].tolist()))
+        return rows
+
+    def _neighbours(self, series, subreddit, timestamp):
+        """
+        Returns the times and values of subreddit and the indices of the next older and newer row
+        (None if there is none).
+        """
+        if subreddit not in series:
+            return None, None, None, None
+        times, values = series.rows(subreddit)
+        t = to_us(timestamp)
+        newer = int(np.searchsorted(times, t, side="right"))
+        older = int(np.searchsorted(times, t, side="left")) - 1
+        return (times, values, older if older >= 0 else None, newer if newer < len(times) else None)
+
+    def _interpolate(self, times, values, older, newer, timestamp):
+        interval = times[newer] - times[older]
+        t = to_us(timestamp)
+        weight_newer = (times[newer] - t) / interval
+        weight_older = (t - times[older]) / interval
+        return weight_newer*np.array(values[newer]) + weight_older*np.array(values[older])
+
+    def _first_last(self, series, start, end, width, subreddits=None):
+        first, last, has_rows = series.first_last(to_us(start), to_us(end))
+        result = {}
+        for i in np.flatnonzero(has_rows):
+            coin = series.coins[i]
+            if subreddits is None or coin in subreddits:
+                newest = tuple(series.values[last[i], :width].tolist())
+                oldest = tuple(series.values[first[i], :width].tolist())
+                result[coin] = (newest, oldest)
+        return result
+
+    # ------------ price table ------------
+
+    def get_interpolated_price_data(self, subreddit, timestamp):
+        """
+        Returns price, percent_change_1h, percent_change_24h
+        Created by linear interpolation using the two nearest datapoints.
+        """
+        times, values, older, newer = self._neighbours(self.price, subreddit, timestamp)
+        if newer is None and older is None:
+            log.warning("No match for %s" % (subreddit))
+            return
+        elif newer is None:
+            return tuple(values[older].tolist())
+        elif older is None:
+            raise ValueError("Cannot interpolate for given timestamp, subreddit: {} {}".format(timestamp, subreddit))
+        return self._interpolate(times, values, older, newer, timestamp)
+
+    def get_all_price_data_in_interval(self, start, end):
+        """
+        Returns all data points for all subreddits in the given interval (newest first).
+        """
+        coin_nr = self._coin_numbers(self.price)
+        return [(self.price.coins[coin_nr[i]],) + tuple(self.price.values[i].tolist())
+                for i in self._newest_first(self.price, start, end)]
+
+    def get_price_series(self, subreddits, start, end):
+        return self._series_rows(self.price, subreddits, start, end)
+
+    def get_first_last_price_in_interval(self, start, end):
+        """
+        Returns the newest and the oldest price for every subreddit in the given interval.
+        format: {subreddit: (newest price, oldest price)}
+        """
+        return {coin: (newest[0], oldest[0])
+                for coin, (newest, oldest) in self._first_last(self.price, start, end, 1).items()}
+
+    # ------------ data table queries------------
+
+    def get_all_subreddits(self):
+        return list(self.data.coins)
+
+    def get_metrics_for_subreddit(self, subreddit, start=None, end=None):
+        """
+        Returns the metrics tuples of subreddit in the given time interval (time is decreasing),
+        see DatabaseConnection.get_metrics_for_subreddit.
+        """
+        if subreddit not in self.data:
+            return []
+        times, values = self.data.rows(subreddit)
+        if start is None and end is None:
+            latest = np.unique(self.data.times)[-2:]
+            idx = np.flatnonzero(np.isin(times, latest))[::-1][:2]
+        else:
+            if start is None: start = datetime.datetime.fromtimestamp(0)
+            if end is None: end = datetime.datetime.utcnow()
+            lo = np.searchsorted(times, to_us(start), side="right")
+            hi = np.searchsorted(times, to_us(end), side="left")
+            idx = np.arange(lo, hi)[::-1]
+        return [tuple(values[i].tolist()) for i in idx]
+
+    def get_data_for_subreddit(self, subreddit, time):
+        """
+        Returns the most recent (i.e. the next older ) metrics tuple
+        for the subreddit and timestamp.
+        """
+        times, values, older, _ = self._neighbours(self.data, subreddit, time)
+        if older is None:
+            raise ValueError("Cannot get data for given timestamp, subreddit: {} {}".format(time, subreddit))
+        return tuple(values[older].tolist())
+
+    def get_all_data_in_interval(self, start, end):
+        """
+        Returns all data points for all subreddits in the given interval
+        """
+        coin_nr = self._coin_numbers(self.data)
+        return [(self.data.coins[coin_nr[i]],) + tuple(self.data.values[i].tolist())
+                for i in self._newest_first(self.data, start, end)]
+
+    def get_data_series(self, subreddits, start, end):
+        return self._series_rows(self.data, subreddits, start, end)
+
+    def get_first_last_data_in_interval(self, start, end, subreddits=None):
+        """
+        Returns the newest and the oldest metrics (subscribers, submission_rate, comment_rate, mention_rate)
+        for every subreddit (or only the given subreddits) in the given interval.
+        format: {subreddit: (newest metrics tuple, oldest metrics tuple)}
+        """
+        if subreddits is not None:
+            subreddits = set(subreddits)
+        return self._first_last(self.data, start, end, 4, subreddits)
+
+    def get_interpolated_data(self, subreddit, timestamp):
+        """
+        Returns a metrics tuple for the subreddit for the given timestamp.
+        Created by linear intrpolation using the two nearest datapoints.
+        """
+        times, values, older, newer = self._neighbours(self.data, subreddit, timestamp)
+        if newer is None and older is None:
+            log.warning("No match for %s" % (subreddit))
+            return []
+        elif newer is None:
+            return tuple(values[older].tolist())
+        elif older is None:
+            raise ValueError("Cannot interpolate for given timestamp, subreddit: {} {}".format(timestamp, subreddit))
+        if times[newer] - times[older] > datetime.timedelta(hours=3) // MICROSECOND:
+            log.warning("Difference of timestamps while interpolating %s is %s" %
+                        (subreddit, from_us(times[newer]) - from_us(times[older])))
+        return self._interpolate(times, values, older, newer, timestamp)
+
+    def get_subreddits_with_data(self, timestamp):
+        """
+        Gets all subreddits that have datapoints before a given datapoint
+        """
+        t = to_us(timestamp)
+        return [c for i, c in enumerate(self.data.coins)
+                if self.data.offsets[i+1] > self.data.offsets[i] and self.data.times[self.data.offsets[i]] < t]
+
+    # ------------ growth snapshot table ------------
+
+    def get_growth_snapshot(self, hours):
+        """
+        Snapshots do not contain the growth_snapshot table, callers fall back to computing the growth.
+        """
+        return []
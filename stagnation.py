@@ -0,0 +1,77 @@
+"""
+Stagnation detection shared by the simulator and the AutoTrader.
+
+The newest and oldest price of every subreddit in the window are fetched with one query
+(DatabaseConnection.get_first_last_price_in_interval) instead of scanning all price rows per coin.
+"""
+import datetime
+
+import numpy as np
+
+import util
+
+log = util.setup_logger(__name__)
+
+
+def price_changes(db, start, end, subreddits=None):
+    """
+    Relative price change between the oldest and the newest price in (start, end).
+    Returns the subreddits (all subreddits with prices if None) and an array of changes
+    which is inf for subreddits without (non zero) prices.
+    """
+    first_last = db.get_first_last_price_in_interval(start, end)
+    if subreddits is None:
+        subreddits = list(first_last.keys())
+    newest = np.array([first_last.get(s, (0, 0))[0] for s in subreddits], dtype=float)
+    oldest = np.array([first_last.get(s, (0, 0))[1] for s in subreddits], dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        changes = (newest - oldest) / oldest
+    changes[(newest == 0) | (oldest == 0)] = np.inf
+    return subreddits, changes
+
+
+def top_n(values, n):
+    """
+    Indices of the n largest values. Ties are broken in favour of the later entries
+    (like reversing a stable ascending sort).
+    """
+    values = np.asarray(values, dtype=float)
+    if n <= 0:
+        return np.empty(0, dtype=int)
+    if n >= len(values):
+        return np.arange(len(values))
+    kth = values[np.argpartition(-values, n - 1)[:n]].min()
+    above = np.flatnonzero(values > kth)
+    tied = np.flatnonzero(values == kth)
+    return np.concatenate([above, tied[len(tied) - (n - len(above)):]])
+
+
+def stagnating(db, subreddits, end, hours, threshold):
+    """
+    Returns those subreddits whose price growth in the last hours hours is below threshold
+    (with one query for all of them). Subreddits without price data are not stagnating.
+    """
+    subreddits = list(subreddits)
+    if not subreddits:
+        return []
+    start = end - datetime.timedelta(hours=hours)
+    _, changes = price_changes(db, start, end, subreddits)
+    for s, c in zip(subreddits, changes):
+        if np.isinf(c):
+            log.warn("No price data for %s. Assuming no stagnation." % (s))
+    return [s for s, c in zip(subreddits, changes) if c < threshold]
+
+
+def top_gainers(db, candidates, end, hours, top_nr, subreddits=None):
+    """
+    Returns those candidates which are among the top_nr gainers of subreddits
+    (all subreddits with prices if None) in the last hours hours.
+    Subreddits without price data count as gainers.
+    """
+    start = end - datetime.timedelta(hours=hours)
+    subreddits, changes = price_changes(db, start, end, subreddits)
+    missing = [s for s, c in zip(subreddits, changes) if np.isinf(c)]
+    if missing:
+        log.warn("No price data for %s. Assuming no stagnation." % (", ".join(missing)))
+    top = set(subreddits[i] for i in top_n(changes, top_nr))
+    return [s for s in candidates if s in top]